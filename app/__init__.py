@@ -1,10 +1,17 @@
 # app/__init__.py
+import time
+_import_started = time.perf_counter()
+
+import logging
 from flask import Flask
 from .config import Config
 from .extensions import db, migrate, ma, jwt
-from .models import User # Import models to ensure they are known to SQLAlchemy/Migrate
+from .models import User, TokenBlocklist, ShardSequence, OutboxEvent # Import models to ensure they are known to SQLAlchemy/Migrate
+
+IMPORT_SECONDS = time.perf_counter() - _import_started # Reported by the preload warm-up
 
 def create_app(config_class=Config):
+    create_started = time.perf_counter()
     #print("--- Creating Flask app instance ---")
     app = Flask(__name__)
     #print(f"--- Applying config from: {config_class} ---")
@@ -13,13 +20,30 @@ def create_app(config_class=Config):
     # Print the DEBUG value *after* loading the config object
     #print(f"--- app.config['DEBUG'] after from_object: {app.config.get('DEBUG')} ---")
 
+    # Shard URIs become SQLAlchemy binds, so this has to run before db.init_app
+    from .utils import sharding
+    sharding.configure_binds(app)
+
     # Initialize extensions
     db.init_app(app)
     migrate.init_app(app, db) # Initialize Flask-Migrate
     ma.init_app(app)
     jwt.init_app(app)
 
-    # ... JWT user lookup loader ...
+    # Shard router (single shard unless SQLALCHEMY_SHARD_URIS is set) and `flask shards` CLI
+    sharding.init_app(app)
+
+    # JWT revocation: Bloom-filter-backed token_in_blocklist_loader
+    from .utils import blocklist
+    blocklist.init_app(app)
+
+    # Versioned /users/ listing cache
+    from .utils import cache
+    cache.init_app(app)
+
+    # Friend-graph change events (transactional outbox + background dispatcher)
+    from .utils import outbox
+    outbox.init_app(app)
 
     # Register Blueprints
     from .routes.auth import auth_bp
@@ -32,6 +56,18 @@ def create_app(config_class=Config):
     app.register_blueprint(friends_bp)
     app.register_blueprint(errors_bp) # Register error handlers
 
+    # Basic console logging for third-party loggers (werkzeug, sqlalchemy)
+    logging.basicConfig(level=logging.INFO)
+
+    # App logger: queued, structured, sampled per endpoint (see utils/log.py)
+    from .utils import log
+    log.init_app(app)
+
+    # Prefork servers: warm everything up once in the parent so forked workers start hot
+    if app.config.get('PRELOAD'):
+        from .utils.warmup import preload
+        preload(app, IMPORT_SECONDS, time.perf_counter() - create_started)
+
     #print(f"--- Final app.config['DEBUG'] before return: {app.config.get('DEBUG')} ---")
     #print("--- Finished creating Flask app instance ---")
     return app
\ No newline at end of file
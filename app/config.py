@@ -1,10 +1,13 @@
 # app/config.py
+import logging
+import math
 import os
 from dotenv import load_dotenv
 
 #print("--- Loading .env file ---")
-# Add verbose=True to see which .env file is loaded (if any)
-loaded_dotenv = load_dotenv(verbose=True)
+# Add verbose=True to see which .env file is loaded (if any); off by default so
+# importing the config (once per worker without preload) stays quiet and cheap
+loaded_dotenv = load_dotenv()
 #print(f"--- .env file loaded: {loaded_dotenv} ---")
 
 # Print the raw environment variable value *after* load_dotenv
@@ -12,12 +15,75 @@ flask_debug_env_var = os.environ.get('FLASK_DEBUG')
 #print(f"--- FLASK_DEBUG from os.environ: '{flask_debug_env_var}' (type: {type(flask_debug_env_var)}) ---")
 
 
+def _parse_sample_rates(raw):
+    # "endpoint=rate,..." -> {endpoint: rate}; malformed items are skipped with a warning
+    rates = {}
+    for item in raw.split(','):
+        if not item.strip():
+            continue
+        endpoint, _, rate = item.partition('=')
+        try:
+            value = float(rate)
+        except ValueError:
+            value = None
+        if not endpoint.strip() or value is None or math.isnan(value) or value < 0:
+            logging.getLogger(__name__).warning(
+                "Ignoring LOG_SAMPLE_RATES item %r: expected endpoint=rate with rate >= 0.", item.strip())
+            continue
+        rates[endpoint.strip()] = value
+    return rates
+
+
 class Config:
     SECRET_KEY = os.environ.get('change this while your running ->SECRET_KEY')
     SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URI')
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+    # Optional horizontal sharding: extra shard URIs, comma-separated. DATABASE_URI is shard 0.
+    SQLALCHEMY_SHARD_URIS = [uri.strip() for uri in os.environ.get('SQLALCHEMY_SHARD_URIS', '').split(',') if uri.strip()]
     JWT_SECRET_KEY = os.environ.get('JWT_SECRET_KEY')
 
+    # Token revocation: revoked JTIs are kept in an in-memory Bloom filter that is
+    # rebuilt from the token_blocklist table every JWT_BLOCKLIST_REFRESH_SECONDS.
+    JWT_BLOCKLIST_REFRESH_SECONDS = int(os.environ.get('JWT_BLOCKLIST_REFRESH_SECONDS', 60))
+    JWT_BLOCKLIST_CAPACITY = int(os.environ.get('JWT_BLOCKLIST_CAPACITY', 10000))
+    JWT_BLOCKLIST_ERROR_RATE = float(os.environ.get('JWT_BLOCKLIST_ERROR_RATE', 0.01))
+
+    # /users/ listing cache: 'none' (default), 'redis' (shared across workers), 'memory'
+    # (per process LRU; other workers can serve pages up to USERS_CACHE_TTL seconds stale)
+    # or a dotted path to a custom backend class.
+    USERS_CACHE_BACKEND = os.environ.get('USERS_CACHE_BACKEND', 'none')
+    USERS_CACHE_MAX_BYTES = int(os.environ.get('USERS_CACHE_MAX_BYTES', 16 * 1024 * 1024))
+    USERS_CACHE_REDIS_URL = os.environ.get('USERS_CACHE_REDIS_URL', 'redis://localhost:6379/0')
+    USERS_CACHE_TTL = int(os.environ.get('USERS_CACHE_TTL', 300))
+
+    # Prefork servers (gunicorn --preload): warm mappers, schemas and the DB pool in the
+    # parent before forking and dispose inherited pools in each worker. See gunicorn.conf.py.
+    PRELOAD = os.environ.get('APP_PRELOAD', 'False').lower() in ('true', '1', 't')
+    PRELOAD_POOL_WARM_SIZE = int(os.environ.get('PRELOAD_POOL_WARM_SIZE', 2))
+    STARTUP_BUDGET_MS = int(os.environ.get('STARTUP_BUDGET_MS', 2000)) # Warn when preload takes longer
+
+    # Logging: records go through a queue to a background listener thread.
+    # LOG_SAMPLE_RATES keeps a fraction of INFO/DEBUG logs per endpoint, e.g.
+    # "friends.accept_friend_request=0.05,friends.list_incoming_requests=0.01".
+    # Requests sending LOG_DEBUG_HEADER equal to LOG_DEBUG_TOKEN get full DEBUG logs.
+    LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO').upper()
+    LOG_FORMAT = os.environ.get('LOG_FORMAT', 'text') # 'text' or 'json'
+    LOG_SAMPLE_RATES = _parse_sample_rates(os.environ.get('LOG_SAMPLE_RATES', ''))
+    LOG_DEBUG_HEADER = os.environ.get('LOG_DEBUG_HEADER', 'X-Debug-Log')
+    LOG_DEBUG_TOKEN = os.environ.get('LOG_DEBUG_TOKEN')
+
+    # Transactional outbox: change events are written with each write and delivered to
+    # in-process subscribers by a background thread (one per worker process). Off by
+    # default since nothing in the app subscribes; enable it when registering subscribers.
+    # Events are only recorded when OUTBOX_ENABLED (default: same as the dispatcher), since
+    # purge never deletes undispatched rows. Set it alone when `flask outbox dispatch` runs from cron.
+    OUTBOX_DISPATCHER_ENABLED = os.environ.get('OUTBOX_DISPATCHER_ENABLED', 'False').lower() in ('true', '1', 't')
+    OUTBOX_ENABLED = os.environ.get('OUTBOX_ENABLED', str(OUTBOX_DISPATCHER_ENABLED)).lower() in ('true', '1', 't')
+    OUTBOX_BATCH_SIZE = int(os.environ.get('OUTBOX_BATCH_SIZE', 200))
+    OUTBOX_POLL_SECONDS = float(os.environ.get('OUTBOX_POLL_SECONDS', 1.0))
+    OUTBOX_RETRY_BASE_SECONDS = float(os.environ.get('OUTBOX_RETRY_BASE_SECONDS', 5.0))
+    OUTBOX_RETRY_MAX_SECONDS = float(os.environ.get('OUTBOX_RETRY_MAX_SECONDS', 300.0))
+
     # Explicitly read FLASK_DEBUG here within the class definition
     debug_value_str = os.environ.get('FLASK_DEBUG', 'False') # Default to 'False' string
     DEBUG = debug_value_str.lower() in ('true', '1', 't')
@@ -53,4 +53,46 @@ class FriendRequest(db.Model):
     )
 
     def __repr__(self):
-        return f'<FriendRequest {self.requester_id} -> {self.recipient_id} ({self.status.name})>'
\ No newline at end of file
+        return f'<FriendRequest {self.requester_id} -> {self.recipient_id} ({self.status.name})>'
+
+class TokenBlocklist(db.Model):
+    __tablename__ = 'token_blocklist'
+    id = db.Column(db.Integer, primary_key=True)
+    jti = db.Column(db.String(36), nullable=False, unique=True, index=True)
+    token_type = db.Column(db.String(10), nullable=False)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id'), nullable=True)
+    revoked_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    # Copied from the token's `exp` claim; rows past this point can never match a valid token
+    expires_at = db.Column(db.DateTime, nullable=True, index=True)
+
+    def __repr__(self):
+        return f'<TokenBlocklist {self.jti} (expires {self.expires_at})>'
+
+
+class ShardSequence(db.Model):
+    # One row per ID allocated on this shard; see ShardRouter.allocate_id
+    __tablename__ = 'shard_sequences'
+    id = db.Column(db.Integer, primary_key=True)
+
+
+class OutboxEvent(db.Model):
+    # Written in the same transaction as the change it describes; see utils/outbox.py
+    __tablename__ = 'outbox_events'
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, nullable=False) # User the event is about (coalescing key)
+    event_type = db.Column(db.String(50), nullable=False) # e.g. 'friend_request.accepted'
+    entity_type = db.Column(db.String(30), nullable=False)
+    entity_id = db.Column(db.Integer, nullable=False)
+    payload = db.Column(db.Text, nullable=True) # JSON
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    dispatched_at = db.Column(db.DateTime, nullable=True)
+    attempts = db.Column(db.Integer, nullable=False, default=0, server_default='0') # Failed deliveries so far
+    next_attempt_at = db.Column(db.DateTime, nullable=True) # Set after a failure; NULL means due now
+
+    __table_args__ = (
+        # Dispatcher polls `WHERE dispatched_at IS NULL ORDER BY id`
+        Index('ix_outbox_events_dispatched_id', 'dispatched_at', 'id'),
+    )
+
+    def __repr__(self):
+        return f'<OutboxEvent {self.event_type} user={self.user_id} ({self.entity_type} {self.entity_id})>'
@@ -3,8 +3,14 @@ from flask import Blueprint, request, jsonify
 from ..models import User, db
 from ..schemas import user_register_schema, user_login_schema, user_profile_schema
 from ..utils.helpers import error_response, success_response
-from flask_jwt_extended import create_access_token
+from ..utils.blocklist import revoke_token
+from ..utils.cache import bump_users_version
+from ..utils.sharding import get_router
+from ..utils.outbox import record_user_event
+from ..utils.log import log_event
+from flask_jwt_extended import create_access_token, jwt_required, get_jwt
 from marshmallow import ValidationError
+import logging
 
 auth_bp = Blueprint('auth', __name__, url_prefix='/auth')
 
@@ -19,17 +25,25 @@ def register():
     # if User.query.filter_by(email=data['email']).first():
     #     return error_response({"email": ["Email already registered."]}, 409) # 409 Conflict
 
-    new_user = User(name=data['name'], email=data['email'])
-    new_user.set_password(data['password'])
+    # Users are placed by email so login only has to look at one shard
+    router = get_router()
+    shard = router.shard_for_email(data['email'])
+    session = router.session(shard)
 
     try:
-        db.session.add(new_user)
-        db.session.commit()
+        new_user = User(id=router.allocate_id(shard), name=data['name'], email=data['email'])
+        new_user.set_password(data['password'])
+        session.add(new_user)
+        session.flush() # Assigns the id the outbox event refers to
+        record_user_event('user.created', new_user)
+        session.commit()
     except Exception as e: # Catch potential DB errors during commit
-        db.session.rollback()
+        session.rollback()
         # Log the error e
         return error_response("Failed to register user due to a database error.", 500)
 
+    bump_users_version() # New user appears in /users/ listings
+
 
     # Exclude password from the response
     user_data = user_profile_schema.dump(new_user)
@@ -43,7 +57,8 @@ def login():
     except ValidationError as err:
         return error_response(err.messages, 400)
 
-    user = User.query.filter_by(email=data['email']).first()
+    router = get_router()
+    user = router.session(router.shard_for_email(data['email'])).query(User).filter_by(email=data['email']).first()
 
     if user and user.check_password(data['password']):
         # --- CHANGE HERE: Convert user.id to string ---
@@ -54,6 +69,21 @@ def login():
     else:
         return error_response("Invalid email or password.", 401)
 
+
+@auth_bp.route('/logout', methods=['POST'])
+@jwt_required()
+def logout():
+    # Revoke the token used for this request; it stays blocked until its own expiry
+    try:
+        revoke_token(get_jwt())
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        log_event(logging.ERROR, "logout_commit_failed", exc_info=True)
+        return error_response("Failed to revoke token due to a database error.", 500)
+
+    return success_response({"message": "Successfully logged out."}, 200)
+
 # TODO: Add Google Authentication routes if implementing
 # /auth/google (initiates flow)
 # /auth/google/callback (handles response from Google)
\ No newline at end of file
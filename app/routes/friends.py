@@ -1,19 +1,54 @@
 # app/routes/friends.py
-from flask import Blueprint, request, jsonify, current_app # Import current_app
+from flask import Blueprint, request, jsonify
 from flask_jwt_extended import jwt_required, get_jwt_identity
-from ..models import User, FriendRequest, FriendRequestStatus, db
+from ..models import FriendRequest, FriendRequestStatus
 from ..schemas import friend_request_schema, friend_requests_schema, users_public_schema
 from ..utils.helpers import error_response, success_response
+from ..utils.loaders import get_user_loader
+from ..utils.sharding import get_router, commit_sessions, rollback_sessions
+from ..utils.log import log_event
+from ..utils.outbox import record_friend_request_event
 from sqlalchemy import or_, and_
 from sqlalchemy.exc import IntegrityError
-import logging # Import logging
+from datetime import datetime
+import logging
 
 friends_bp = Blueprint('friends', __name__, url_prefix='/friend-requests')
 
-# Configure basic logging if not already done elsewhere (e.g., in create_app)
-# This ensures INFO messages appear on the console if Flask's default level is higher
-# You might move this to your app factory (__init__.py) for better structure
-logging.basicConfig(level=logging.INFO)
+
+def _sync_mirrors(friend_request, home_session, sessions):
+    # With sharding, a request lives on the requester's (home) shard and is mirrored to
+    # the recipient's shard. Bring every copy in `sessions` in line with `friend_request`,
+    # recreating a copy lost to a partially failed cross-shard commit.
+    for session in sessions:
+        if session is home_session:
+            continue
+        copy = session.get(FriendRequest, friend_request.id)
+        if copy is None:
+            copy = FriendRequest(id=friend_request.id, requester_id=friend_request.requester_id,
+                                 recipient_id=friend_request.recipient_id, created_at=friend_request.created_at)
+            session.add(copy)
+        copy.status = friend_request.status
+
+
+def _repair_mirrors(friend_request, sessions):
+    # Before refusing a send (409) or an accept/reject (400) because of the request's
+    # state, bring any copy a partially failed cross-shard commit left missing or stale
+    # in line with the home copy; otherwise the recipient could keep seeing (and failing
+    # to act on) the wrong state in /incoming
+    if len(sessions) < 2:
+        return
+    router = get_router()
+    home_session = router.session(router.shard_for_id(friend_request.id))
+    home_copy = home_session.get(FriendRequest, friend_request.id) # The home copy is authoritative
+    if home_copy is None:
+        return
+    try:
+        _sync_mirrors(home_copy, home_session, sessions)
+        commit_sessions(sessions)
+    except Exception:
+        rollback_sessions(sessions)
+        log_event(logging.ERROR, "mirror_repair_failed", exc_info=True, request_id=friend_request.id)
 
 
 @friends_bp.route('/send/<int:recipient_id>', methods=['POST'])
@@ -24,7 +59,7 @@ def send_friend_request(recipient_id):
         requester_id_str = get_jwt_identity()
         requester_id = int(requester_id_str)
     except (ValueError, TypeError):
-         current_app.logger.error(f"Invalid JWT identity format: {requester_id_str}")
+         log_event(logging.ERROR, "invalid_jwt_identity", identity=requester_id_str)
          # You might want a more specific error response here
          return error_response("Invalid user identity in token.", 400)
     # --- End conversion ---
@@ -33,18 +68,31 @@ def send_friend_request(recipient_id):
     if requester_id == recipient_id:
         return error_response("Cannot send friend request to yourself.", 400)
 
-    recipient = User.query.get(recipient_id)
+    recipient = get_user_loader().load(recipient_id) # Reused when dumping the new request below
     if not recipient:
         return error_response("Recipient user not found.", 404)
 
+    # The requester's shard holds every request they are part of, in either direction
+    router = get_router()
+    session = router.session_for_user(requester_id)
+    sessions = router.sessions_for_pair(requester_id, recipient_id)
+
     # Check if a request already exists (in either direction) or they are already friends
-    # Ensure comparisons use integer IDs
-    existing_request = FriendRequest.query.filter(
-        or_(
-            and_(FriendRequest.requester_id == requester_id, FriendRequest.recipient_id == recipient_id),
-            and_(FriendRequest.requester_id == recipient_id, FriendRequest.recipient_id == requester_id)
-        )
-    ).first()
+    # Ensure comparisons use integer IDs. With sharding both users' shards are checked,
+    # so a copy missing after a partially failed commit is still found (and repaired)
+    existing_request = None
+    for shard_session in sessions:
+        existing_request = shard_session.query(FriendRequest).filter(
+            or_(
+                and_(FriendRequest.requester_id == requester_id, FriendRequest.recipient_id == recipient_id),
+                and_(FriendRequest.requester_id == recipient_id, FriendRequest.recipient_id == requester_id)
+            )
+        ).first()
+        if existing_request:
+            break
+
+    if existing_request and existing_request.status != FriendRequestStatus.REJECTED:
+        _repair_mirrors(existing_request, sessions)
 
     if existing_request:
         if existing_request.status == FriendRequestStatus.ACCEPTED:
@@ -56,30 +104,39 @@ def send_friend_request(recipient_id):
              else:
                  return error_response("This user has already sent you a friend request. Please accept or reject it.", 409)
         elif existing_request.status == FriendRequestStatus.REJECTED:
-             # Re-sending after rejection: delete old one, create new pending one.
-             db.session.delete(existing_request)
+             # Re-sending after rejection: delete old one (every copy), create new pending one.
+             for shard_session in sessions:
+                 old_copy = shard_session.get(FriendRequest, existing_request.id)
+                 if old_copy is not None:
+                     shard_session.delete(old_copy)
              # Fall through to create the new request...
 
-    # Create using integer IDs
-    new_request = FriendRequest(requester_id=requester_id, recipient_id=recipient_id, status=FriendRequestStatus.PENDING)
-
     try:
-        db.session.add(new_request)
-        db.session.commit()
+        # Create using integer IDs, minted on the requester's shard
+        new_request = FriendRequest(id=router.allocate_id(router.shard_for_user(requester_id)),
+                                    requester_id=requester_id, recipient_id=recipient_id,
+                                    status=FriendRequestStatus.PENDING, created_at=datetime.utcnow())
+        session.add(new_request)
+        session.flush() # Assigns the autoincrement id when unsharded
+        _sync_mirrors(new_request, session, sessions)
+        record_friend_request_event('friend_request.sent', new_request)
+        commit_sessions(sessions)
         # Use schema to return consistent output
         return success_response({"message": "Friend request sent successfully.", "request": friend_request_schema.dump(new_request)}, 201)
     except IntegrityError as e: # Catch potential unique constraint violation
-         db.session.rollback()
+         rollback_sessions(sessions)
          # Check if it's the specific unique constraint error
          # Note: Error message structure might vary slightly between DBs/versions
          if "uq_friend_request_pair" in str(e.orig) or "Duplicate entry" in str(e.orig):
              return error_response({"request": ["Friend request relationship already exists or is pending."]}, 409)
          else:
-             current_app.logger.error(f"Database integrity error sending request from {requester_id} to {recipient_id}. Error: {e}", exc_info=True)
+             log_event(logging.ERROR, "send_request_integrity_error", exc_info=True,
+                       requester_id=requester_id, recipient_id=recipient_id)
              return error_response("Database error occurred while sending request.", 500)
-    except Exception as e:
-        db.session.rollback()
-        current_app.logger.error(f"Failed to send friend request from {requester_id} to {recipient_id}. Error: {e}", exc_info=True)
+    except Exception:
+        rollback_sessions(sessions)
+        log_event(logging.ERROR, "send_request_failed", exc_info=True,
+                  requester_id=requester_id, recipient_id=recipient_id)
         return error_response("Failed to send friend request.", 500)
 
 
@@ -87,51 +144,55 @@ def send_friend_request(recipient_id):
 @jwt_required()
 def accept_friend_request(request_id):
     current_user_identity = get_jwt_identity() # Get raw string identity from token
-    current_app.logger.info(f"--- Attempting to accept request_id: {request_id}")
-    current_app.logger.info(f"--- JWT Identity (sub claim): '{current_user_identity}' (type: {type(current_user_identity)})")
+    # Per-request diagnostics: only built when DEBUG is on or the debug header is sent
+    log_event(logging.DEBUG, "accept_request_start", request_id=request_id, identity=current_user_identity)
 
     try:
         # Convert the string identity from JWT to an integer for comparison
         current_user_id = int(current_user_identity)
-        current_app.logger.info(f"--- Converted current_user_id to int: {current_user_id} (type: {type(current_user_id)})")
     except (ValueError, TypeError):
         # Handle cases where JWT sub is not a valid integer string
-        current_app.logger.error(f"--- Failed to convert JWT identity '{current_user_identity}' to int.")
+        log_event(logging.ERROR, "invalid_jwt_identity", identity=current_user_identity)
         return error_response("Invalid user identity in token.", 400)
 
 
-    friend_request = FriendRequest.query.get(request_id) # Fetch by primary key
+    # Fetch by primary key from the request's home (requester's) shard
+    router = get_router()
+    session = router.session(router.shard_for_id(request_id))
+    friend_request = session.get(FriendRequest, request_id)
 
     if not friend_request:
-        current_app.logger.warning(f"--- Friend request with id {request_id} not found.")
+        log_event(logging.WARNING, "accept_request_not_found", request_id=request_id)
         return error_response("Friend request not found.", 404)
 
-    # --- CRITICAL LOGGING ---
-    # Log the types and values being compared
-    current_app.logger.info(f"--- Found friend_request.id: {friend_request.id}")
-    current_app.logger.info(f"--- Friend_request.recipient_id from DB: {friend_request.recipient_id} (type: {type(friend_request.recipient_id)})")
-    current_app.logger.info(f"--- Current_user_id from token (as int): {current_user_id} (type: {type(current_user_id)})")
-    current_app.logger.info(f"--- Checking authorization condition: friend_request.recipient_id ({friend_request.recipient_id}) != current_user_id ({current_user_id})")
-    # --- END CRITICAL LOGGING ---
+    log_event(logging.DEBUG, "accept_request_loaded", request_id=friend_request.id,
+              recipient_id=friend_request.recipient_id, user_id=current_user_id)
 
     # Compare integer values
     if friend_request.recipient_id != current_user_id:
-        current_app.logger.warning(f"--- AUTHORIZATION FAILED: User {current_user_id} cannot accept request {request_id} intended for user {friend_request.recipient_id}.")
+        log_event(logging.WARNING, "accept_request_forbidden", request_id=request_id,
+                  user_id=current_user_id, recipient_id=friend_request.recipient_id)
         return error_response("You are not authorized to respond to this request.", 403)
 
     # Check if the request is actually pending
     if friend_request.status != FriendRequestStatus.PENDING:
-        current_app.logger.warning(f"--- Request {request_id} is not pending (status: {friend_request.status.value}). Cannot accept.")
+        log_event(logging.WARNING, "accept_request_not_pending", request_id=request_id,
+                  status=friend_request.status.value)
+        # The recipient's copy may still say pending after a partially failed commit
+        _repair_mirrors(friend_request, router.sessions_for_pair(friend_request.requester_id, friend_request.recipient_id))
         return error_response(f"Request is not pending (status: {friend_request.status.value}).", 400)
 
     friend_request.status = FriendRequestStatus.ACCEPTED
+    sessions = router.sessions_for_pair(friend_request.requester_id, friend_request.recipient_id)
     try:
-        db.session.commit()
-        current_app.logger.info(f"--- Successfully accepted request {request_id} by user {current_user_id}.")
+        _sync_mirrors(friend_request, session, sessions)
+        record_friend_request_event('friend_request.accepted', friend_request)
+        commit_sessions(sessions)
+        log_event(logging.INFO, "friend_request_accepted", request_id=request_id, user_id=current_user_id)
         return success_response({"message": "Friend request accepted.", "request": friend_request_schema.dump(friend_request)}, 200)
-    except Exception as e:
-        db.session.rollback()
-        current_app.logger.error(f"--- Database error committing acceptance for request {request_id}. Error: {e}", exc_info=True)
+    except Exception:
+        rollback_sessions(sessions)
+        log_event(logging.ERROR, "accept_request_commit_failed", exc_info=True, request_id=request_id)
         return error_response("Failed to accept friend request.", 500)
 
 
@@ -143,11 +204,13 @@ def reject_friend_request(request_id):
         current_user_identity = get_jwt_identity()
         current_user_id = int(current_user_identity)
     except (ValueError, TypeError):
-         current_app.logger.error(f"Invalid JWT identity format: {current_user_identity}")
+         log_event(logging.ERROR, "invalid_jwt_identity", identity=current_user_identity)
          return error_response("Invalid user identity in token.", 400)
     # --- End conversion ---
 
-    friend_request = FriendRequest.query.get(request_id)
+    router = get_router()
+    session = router.session(router.shard_for_id(request_id))
+    friend_request = session.get(FriendRequest, request_id)
 
     if not friend_request:
         return error_response("Friend request not found.", 404)
@@ -157,18 +220,23 @@ def reject_friend_request(request_id):
         return error_response("You are not authorized to respond to this request.", 403)
 
     if friend_request.status != FriendRequestStatus.PENDING:
+        # The recipient's copy may still say pending after a partially failed commit
+        _repair_mirrors(friend_request, router.sessions_for_pair(friend_request.requester_id, friend_request.recipient_id))
         return error_response(f"Request is not pending (status: {friend_request.status.value}).", 400)
 
     friend_request.status = FriendRequestStatus.REJECTED
+    sessions = router.sessions_for_pair(friend_request.requester_id, friend_request.recipient_id)
     try:
         # Optionally, you could delete the rejected request immediately or later
         # db.session.delete(friend_request)
-        db.session.commit()
-        current_app.logger.info(f"--- Successfully rejected request {request_id} by user {current_user_id}.")
+        _sync_mirrors(friend_request, session, sessions)
+        record_friend_request_event('friend_request.rejected', friend_request)
+        commit_sessions(sessions)
+        log_event(logging.INFO, "friend_request_rejected", request_id=request_id, user_id=current_user_id)
         return success_response({"message": "Friend request rejected.", "request": friend_request_schema.dump(friend_request)}, 200)
-    except Exception as e:
-        db.session.rollback()
-        current_app.logger.error(f"--- Database error committing rejection for request {request_id}. Error: {e}", exc_info=True)
+    except Exception:
+        rollback_sessions(sessions)
+        log_event(logging.ERROR, "reject_request_commit_failed", exc_info=True, request_id=request_id)
         return error_response("Failed to reject friend request.", 500)
 
 
@@ -180,12 +248,13 @@ def list_incoming_requests():
         current_user_identity = get_jwt_identity()
         current_user_id = int(current_user_identity)
     except (ValueError, TypeError):
-         current_app.logger.error(f"Invalid JWT identity format: {current_user_identity}")
+         log_event(logging.ERROR, "invalid_jwt_identity", identity=current_user_identity)
          return error_response("Invalid user identity in token.", 400)
     # --- End conversion ---
 
-    # Filter using integer ID
-    incoming_requests = FriendRequest.query.filter(
+    # Filter using integer ID, on the caller's own shard
+    session = get_router().session_for_user(current_user_id)
+    incoming_requests = session.query(FriendRequest).filter(
         FriendRequest.recipient_id == current_user_id,
         FriendRequest.status == FriendRequestStatus.PENDING
     ).order_by(FriendRequest.created_at.desc()).all()
@@ -201,12 +270,13 @@ def list_friends():
         current_user_identity = get_jwt_identity()
         current_user_id = int(current_user_identity)
     except (ValueError, TypeError):
-         current_app.logger.error(f"Invalid JWT identity format: {current_user_identity}")
+         log_event(logging.ERROR, "invalid_jwt_identity", identity=current_user_identity)
          return error_response("Invalid user identity in token.", 400)
     # --- End conversion ---
 
     # Find accepted requests where the current user (as integer ID) is requester or recipient
-    accepted_requests = FriendRequest.query.filter(
+    session = get_router().session_for_user(current_user_id)
+    accepted_requests = session.query(FriendRequest).filter(
         FriendRequest.status == FriendRequestStatus.ACCEPTED,
         or_(
             FriendRequest.requester_id == current_user_id,
@@ -224,7 +294,7 @@ def list_friends():
     if not friend_ids:
         return success_response({"friends": []}, 200)
 
-    # Fetch friend user objects using the set of integer IDs
-    friends = User.query.filter(User.id.in_(list(friend_ids))).all()
+    # Fetch friend user objects using the set of integer IDs (one IN query)
+    friends = [u for u in get_user_loader().load_many(list(friend_ids)) if u is not None]
 
     return success_response({"friends": users_public_schema.dump(friends)}, 200)
\ No newline at end of file
@@ -1,20 +1,31 @@
 # app/routes/users.py
 from flask import Blueprint, request, jsonify, current_app
 from flask_jwt_extended import jwt_required, get_jwt_identity
-from ..models import User, FriendRequest, FriendRequestStatus, db
+from ..models import User, FriendRequest, FriendRequestStatus
 from ..schemas import user_profile_schema, user_public_schema, users_public_schema, user_update_schema
 from ..utils.helpers import error_response, success_response
+from ..utils.loaders import get_user_loader
+from ..utils.cache import cached_listing_fragment, bump_users_version
+from ..utils.sharding import get_router
+from ..utils.outbox import record_user_event
 from marshmallow import ValidationError
 from sqlalchemy import or_, and_, not_, func # Import func for RAND()
+import heapq
+import math
 import random
 
 users_bp = Blueprint('users', __name__, url_prefix='/users')
 
+BATCH_MAX_IDS = 100 # Upper bound on ids accepted by /users/batch
+
 @users_bp.route('/profile', methods=['GET'])
 @jwt_required()
 def get_profile():
-    current_user_id = get_jwt_identity()
-    user = User.query.get(current_user_id)
+    try:
+        current_user_id = int(get_jwt_identity())
+    except (ValueError, TypeError):
+        return error_response("Invalid user identity in token.", 400)
+    user = get_router().session_for_user(current_user_id).get(User, current_user_id)
     if not user:
         return error_response("User not found.", 404) # Should not happen if JWT is valid
 
@@ -23,8 +34,12 @@ def get_profile():
 @users_bp.route('/profile', methods=['PUT'])
 @jwt_required()
 def update_profile():
-    current_user_id = get_jwt_identity()
-    user = User.query.get(current_user_id)
+    try:
+        current_user_id = int(get_jwt_identity())
+    except (ValueError, TypeError):
+        return error_response("Invalid user identity in token.", 400)
+    session = get_router().session_for_user(current_user_id)
+    user = session.get(User, current_user_id)
     if not user:
         return error_response("User not found.", 404)
 
@@ -40,70 +55,155 @@ def update_profile():
         user.bio = data['bio']
 
     try:
-        db.session.commit()
+        record_user_event('user.updated', user)
+        session.commit()
     except Exception as e:
-        db.session.rollback()
+        session.rollback()
         # Log error e
         return error_response("Failed to update profile.", 500)
 
+    bump_users_version() # Cached /users/ pages may show the old name/bio
+
     return success_response(user_profile_schema.dump(user), 200)
 
 
 @users_bp.route('/', methods=['GET'])
 @jwt_required()
 def list_users():
-    current_user_id = get_jwt_identity()
+    try:
+        current_user_id = int(get_jwt_identity())
+    except (ValueError, TypeError):
+        return error_response("Invalid user identity in token.", 400)
 
     # --- Filtering for Search (Bonus) ---
     search_query = request.args.get('search', None)
 
-    query = User.query.filter(User.id != current_user_id)
-
-    if search_query:
-        query = query.filter(User.name.ilike(f"%{search_query}%")) # Case-insensitive search
-
     # --- Pagination (Bonus) ---
     page = request.args.get('page', 1, type=int)
     per_page = request.args.get('per_page', 10, type=int) # Default 10 users per page
-    paginated_users = query.paginate(page=page, per_page=per_page, error_out=False)
-
-    users = paginated_users.items
-    result = users_public_schema.dump(users)
+    # Same normalisation paginate(error_out=False) used to apply
+    if page < 1:
+        page = 1
+    if per_page < 1:
+        per_page = 20
+
+    # The cached fragment is shared by all callers, so it is built *without* excluding
+    # anyone; the caller is removed below.
+    fragment = cached_listing_fragment(search_query, page, per_page,
+                                       lambda: _build_listing_fragment(search_query, page, per_page))
+
+    window = fragment["users"]
+    caller_in_window = any(u["id"] == current_user_id for u in window)
+    if caller_in_window or not search_query:
+        caller_matches = True # Unfiltered listing with no search contains every user
+    else:
+        caller_matches = get_router().session_for_user(current_user_id).query(User).filter(
+            User.id == current_user_id, User.name.ilike(f"%{search_query}%")
+        ).count() > 0
+
+    if caller_in_window:
+        result = [u for u in window if u["id"] != current_user_id][:per_page]
+    elif caller_matches and window and current_user_id < window[0]["id"]:
+        # Caller sorts before this page, so every row shifts up by one; the extra row
+        # fetched past the page end fills the gap
+        result = window[1:per_page + 1]
+    else:
+        result = window[:per_page]
+
+    total = fragment["total"] - (1 if caller_matches else 0)
+    pages = math.ceil(total / per_page) if total else 0
 
     return success_response({
         "users": result,
-        "total": paginated_users.total,
-        "pages": paginated_users.pages,
-        "current_page": paginated_users.page,
-        "per_page": paginated_users.per_page,
-        "has_next": paginated_users.has_next,
-        "has_prev": paginated_users.has_prev
+        "total": total,
+        "pages": pages,
+        "current_page": page,
+        "per_page": per_page,
+        "has_next": page < pages,
+        "has_prev": page > 1
     }, 200)
 
 
+def _build_listing_fragment(search_query, page, per_page):
+    router = get_router()
+    offset = (page - 1) * per_page
+
+    def shard_page(session):
+        query = session.query(User)
+        if search_query:
+            query = query.filter(User.name.ilike(f"%{search_query}%")) # Case-insensitive search
+        # Ordered by id so pages are stable, with one row past the page end for caller removal
+        query = query.order_by(User.id)
+        if router.sharded:
+            # Scatter: every shard returns its first offset + per_page + 1 rows
+            return query.count(), query.limit(offset + per_page + 1).all()
+        return query.count(), query.offset(offset).limit(per_page + 1).all()
+
+    results = router.scatter(shard_page)
+    total = sum(count for count, _ in results)
+    if router.sharded:
+        # Gather: merge the per-shard id orderings and cut out the window
+        merged = list(heapq.merge(*(rows for _, rows in results), key=lambda u: u.id))
+        users = merged[offset:offset + per_page + 1]
+    else:
+        users = results[0][1]
+    return {"total": total, "users": users_public_schema.dump(users)}
+
+
+@users_bp.route('/batch', methods=['GET'])
+@jwt_required()
+def get_users_batch():
+    # Accepts ?ids=1,2,3 and/or repeated ?ids=1&ids=2
+    raw_ids = [part for value in request.args.getlist('ids') for part in value.split(',') if part.strip()]
+    try:
+        user_ids = [int(part) for part in raw_ids]
+    except ValueError:
+        return error_response({"ids": ["Must be a comma-separated list of integer user IDs."]}, 400)
+
+    if not user_ids:
+        return error_response({"ids": ["At least one user ID is required."]}, 400)
+
+    user_ids = list(dict.fromkeys(user_ids)) # De-duplicate, keep request order
+    if len(user_ids) > BATCH_MAX_IDS:
+        return error_response({"ids": [f"At most {BATCH_MAX_IDS} user IDs per request."]}, 400)
+
+    users = get_user_loader().load_many(user_ids)
+    found = [u for u in users if u is not None]
+    missing = [uid for uid, u in zip(user_ids, users) if u is None]
+
+    return success_response({"users": users_public_schema.dump(found), "missing": missing}, 200)
+
+
 @users_bp.route('/suggestions', methods=['GET'])
 @jwt_required()
 def get_suggestions():
-    current_user_id = get_jwt_identity()
+    try:
+        current_user_id = int(get_jwt_identity())
+    except (ValueError, TypeError):
+        return error_response("Invalid user identity in token.", 400)
     limit = 5 # Suggest 5 users
 
+    # The caller's shard holds a copy of every request they sent or received
+    router = get_router()
+    session = router.session_for_user(current_user_id)
+
     # 1. Find IDs of current friends
-    friends1 = db.session.query(FriendRequest.recipient_id).filter(
+    friends1 = session.query(FriendRequest.recipient_id).filter(
         FriendRequest.requester_id == current_user_id,
         FriendRequest.status == FriendRequestStatus.ACCEPTED
     )
-    friends2 = db.session.query(FriendRequest.requester_id).filter(
+    friends2 = session.query(FriendRequest.requester_id).filter(
         FriendRequest.recipient_id == current_user_id,
         FriendRequest.status == FriendRequestStatus.ACCEPTED
     )
     friend_ids = {row[0] for row in friends1.union(friends2).all()} # Use set for efficiency
 
     # 2. Find IDs of users with pending requests (sent or received)
-    pending1 = db.session.query(FriendRequest.recipient_id).filter(
+    pending1 = session.query(FriendRequest.recipient_id).filter(
         FriendRequest.requester_id == current_user_id,
         FriendRequest.status == FriendRequestStatus.PENDING
     )
-    pending2 = db.session.query(FriendRequest.requester_id).filter(
+    pending2 = session.query(FriendRequest.requester_id).filter(
         FriendRequest.recipient_id == current_user_id,
         FriendRequest.status == FriendRequestStatus.PENDING
     )
@@ -113,27 +213,17 @@ def get_suggestions():
     exclude_ids = friend_ids.union(pending_ids)
     exclude_ids.add(current_user_id)
 
-    # 4. Query for users excluding the excluded IDs, order randomly and limit
-    # Using func.rand() for MySQL. For PostgreSQL use func.random().
+    # 4. Query each shard for users excluding the excluded IDs, order randomly and limit.
+    # RAND() on MySQL, RANDOM() elsewhere (SQLite/PostgreSQL).
     # Be aware: RAND()/random() can be slow on large tables.
-    # Alternative: Fetch more users than needed and use random.sample in Python.
-    suggested_users = User.query.filter(
-        not_(User.id.in_(list(exclude_ids)))
-    ).order_by(func.rand()).limit(limit).all()
-
-    # Fallback if not enough random users found (e.g., very small user base)
-    if len(suggested_users) < limit:
-         # Fetch any users not excluded, limit again
-         additional_users = User.query.filter(
-             not_(User.id.in_(list(exclude_ids)))
-         ).limit(limit).all()
-         # Simple merge and take unique up to limit (less random)
-         seen_ids = {u.id for u in suggested_users}
-         for u in additional_users:
-             if len(suggested_users) >= limit: break
-             if u.id not in seen_ids:
-                 suggested_users.append(u)
-                 seen_ids.add(u.id)
-
-
-    return success_response(users_public_schema.dump(suggested_users), 200)
\ No newline at end of file
+    def random_candidates(shard_session):
+        random_fn = func.rand() if shard_session.get_bind().dialect.name == 'mysql' else func.random()
+        return shard_session.query(User).filter(
+            not_(User.id.in_(list(exclude_ids)))
+        ).order_by(random_fn).limit(limit).all()
+
+    # Gather: up to `limit` per shard, then sample across shards
+    candidates = [u for rows in router.scatter(random_candidates) for u in rows]
+    suggested_users = random.sample(candidates, min(limit, len(candidates)))
+
+    return success_response(users_public_schema.dump(suggested_users), 200)
@@ -1,7 +1,8 @@
 # app/schemas.py
 from .extensions import ma
 from .models import User, FriendRequest, FriendRequestStatus
-from marshmallow import fields, validate, ValidationError
+from .utils.loaders import get_user_loader
+from marshmallow import fields, validate, ValidationError, pre_dump
 
 # Basic schema for user data visible publicly or to other users
 class UserPublicSchema(ma.SQLAlchemyAutoSchema):
@@ -34,10 +35,19 @@ class UserUpdateSchema(ma.Schema):
     name = fields.String(validate=validate.Length(min=1, max=80))
     bio = fields.String(allow_none=True) # Allow setting bio to null/empty
 
+# Nested user resolved by primary key through the request-scoped UserLoader
+class LoadedUser(fields.Nested):
+    def __init__(self, id_attr, nested, **kwargs):
+        self.id_attr = id_attr
+        super().__init__(nested, **kwargs)
+
+    def get_value(self, obj, attr, accessor=None, default=None):
+        return get_user_loader().load(getattr(obj, self.id_attr))
+
 # Schema for displaying friend requests (showing user details)
 class FriendRequestSchema(ma.SQLAlchemyAutoSchema):
-    requester = fields.Nested(UserPublicSchema, only=("id", "name", "email"))
-    recipient = fields.Nested(UserPublicSchema, only=("id", "name", "email"))
+    requester = LoadedUser("requester_id", UserPublicSchema, only=("id", "name", "email"), dump_only=True)
+    recipient = LoadedUser("recipient_id", UserPublicSchema, only=("id", "name", "email"), dump_only=True)
     status = fields.Method("get_status_string", deserialize="load_status_string") # Use string representation
 
     class Meta:
@@ -45,6 +55,13 @@ class FriendRequestSchema(ma.SQLAlchemyAutoSchema):
         load_instance = True
         include_fk = True # Include requester_id and recipient_id if needed
 
+    @pre_dump(pass_many=True)
+    def queue_users(self, data, many, **kwargs):
+        # Queue every requester/recipient up front so the nested fields share one IN query
+        requests = data if many else [data]
+        get_user_loader().queue(uid for fr in requests for uid in (fr.requester_id, fr.recipient_id))
+        return data
+
     def get_status_string(self, obj):
         return obj.status.value # Return 'pending', 'accepted', 'rejected'
 
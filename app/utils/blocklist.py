@@ -0,0 +1,151 @@
+# app/utils/blocklist.py
+import hashlib
+import math
+import threading
+import time
+from datetime import datetime
+
+from flask import current_app
+from sqlalchemy import or_
+
+from ..extensions import db, jwt
+from ..models import TokenBlocklist
+from .helpers import error_response
+
+
+class BloomFilter:
+    """Fixed-size Bloom filter over strings (no false negatives, tunable false positives)."""
+
+    def __init__(self, capacity, error_rate=0.01):
+        capacity = max(int(capacity), 1)
+        # Standard sizing: m = -n*ln(p) / ln(2)^2 bits, k = (m/n) * ln(2) hash functions
+        self.num_bits = max(int(-capacity * math.log(error_rate) / (math.log(2) ** 2)), 8)
+        self.num_hashes = max(int(round(self.num_bits / capacity * math.log(2))), 1)
+        self.bits = bytearray((self.num_bits + 7) // 8)
+
+    def _positions(self, item):
+        # Double hashing (Kirsch-Mitzenmacher): derive k positions from one 128-bit digest
+        digest = hashlib.blake2b(item.encode('utf-8'), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return [(h1 + i * h2) % self.num_bits for i in range(self.num_hashes)]
+
+    def add(self, item):
+        for pos in self._positions(item):
+            self.bits[pos >> 3] |= 1 << (pos & 7)
+
+    def __contains__(self, item):
+        return all(self.bits[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(item))
+
+
+class RevokedTokenFilter:
+    """
+    Per-process view of the token_blocklist table.
+
+    Checks hit the Bloom filter only; the table is consulted when the filter reports a
+    possible match. The filter is rebuilt from unexpired rows once it is older than
+    `refresh_seconds`, which both drops expired JTIs and picks up revocations made by
+    other worker processes.
+
+    Revocations made by this process are also kept in `_recent` and merged into every
+    rebuild: a rebuild whose query ran before the revoking commit would otherwise drop
+    them. Entries are kept for one more refresh period after they are added, by which
+    point the row is committed and any later rebuild reads it from the table.
+    """
+
+    def __init__(self, capacity, error_rate, refresh_seconds):
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.refresh_seconds = refresh_seconds
+        self._filter = BloomFilter(capacity, error_rate)
+        self._built_at = None # Forces a build on first use
+        self._recent = {} # jti -> monotonic time it was revoked here
+        self._lock = threading.Lock()
+        self._recent_lock = threading.Lock()
+
+    def rebuild(self):
+        started = time.monotonic()
+        now = datetime.utcnow()
+        jtis = [row[0] for row in db.session.query(TokenBlocklist.jti).filter(
+            or_(TokenBlocklist.expires_at.is_(None), TokenBlocklist.expires_at > now)
+        ).all()]
+
+        # Merge and swap under the same lock as add(), so a revocation can't land in
+        # the old filter after the merge and be lost with it
+        with self._recent_lock:
+            self._recent = {jti: added for jti, added in self._recent.items()
+                            if started - added < self.refresh_seconds}
+            jtis.extend(self._recent)
+
+            # Leave headroom so revocations added between rebuilds don't degrade the error rate
+            bloom = BloomFilter(max(self.capacity, len(jtis) * 2), self.error_rate)
+            for jti in jtis:
+                bloom.add(jti)
+
+            self._filter = bloom # Swap in one assignment; readers never see a half-built filter
+            self._built_at = time.monotonic()
+
+    def refresh_if_stale(self):
+        if self._built_at is not None and time.monotonic() - self._built_at < self.refresh_seconds:
+            return
+        with self._lock:
+            # Another thread may have rebuilt while we were waiting for the lock
+            if self._built_at is None or time.monotonic() - self._built_at >= self.refresh_seconds:
+                self.rebuild()
+
+    def add(self, jti):
+        with self._recent_lock:
+            self._recent[jti] = time.monotonic()
+            self._filter.add(jti)
+
+    def might_contain(self, jti):
+        self.refresh_if_stale()
+        return jti in self._filter
+
+
+def get_revoked_filter():
+    return current_app.extensions['token_blocklist']
+
+
+def revoke_token(jwt_payload):
+    """Record the token described by `jwt_payload` as revoked. Caller commits the session."""
+    exp = jwt_payload.get('exp')
+    try:
+        user_id = int(jwt_payload.get('sub'))
+    except (ValueError, TypeError):
+        user_id = None
+
+    entry = TokenBlocklist(
+        jti=jwt_payload['jti'],
+        token_type=jwt_payload.get('type', 'access'),
+        user_id=user_id,
+        expires_at=datetime.utcfromtimestamp(exp) if exp is not None else None,
+    )
+    db.session.add(entry)
+    # Visible to this worker immediately (and kept across rebuilds until the row is
+    # committed); other workers see it after their next rebuild
+    get_revoked_filter().add(entry.jti)
+    return entry
+
+
+@jwt.token_in_blocklist_loader
+def check_if_token_revoked(jwt_header, jwt_payload):
+    jti = jwt_payload['jti']
+    if not get_revoked_filter().might_contain(jti):
+        return False # Common path: definitely not revoked, no query issued
+
+    # Possible hit (or a false positive) - confirm against the table
+    return db.session.query(TokenBlocklist.id).filter_by(jti=jti).first() is not None
+
+
+@jwt.revoked_token_loader
+def revoked_token_response(jwt_header, jwt_payload):
+    return error_response("Token has been revoked.", 401)
+
+
+def init_app(app):
+    app.extensions['token_blocklist'] = RevokedTokenFilter(
+        capacity=app.config.get('JWT_BLOCKLIST_CAPACITY', 10000),
+        error_rate=app.config.get('JWT_BLOCKLIST_ERROR_RATE', 0.01),
+        refresh_seconds=app.config.get('JWT_BLOCKLIST_REFRESH_SECONDS', 60),
+    )
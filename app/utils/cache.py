@@ -0,0 +1,199 @@
+# app/utils/cache.py
+import importlib
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+from flask import current_app
+
+from .log import log_event
+
+USERS_VERSION_KEY = 'users:version'
+
+
+class MemoryCacheBackend:
+    """
+    In-process LRU cache bounded by the total size of stored values (in bytes).
+
+    Each worker keeps its own entries and its own users version, so a bump on one
+    worker doesn't reach the others: they keep serving their pages until the entries
+    expire after `ttl` seconds. Only use it with a single worker process, or when
+    listings up to `ttl` seconds stale are acceptable.
+    """
+
+    def __init__(self, max_bytes=16 * 1024 * 1024, ttl=300, **kwargs):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.current_bytes = 0
+        self._data = OrderedDict() # key -> (value, size, expires_at)
+        self._counters = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            value, size, expires_at = entry
+            if expires_at is not None and time.monotonic() >= expires_at:
+                del self._data[key]
+                self.current_bytes -= size
+                return None
+            self._data.move_to_end(key) # Mark as most recently used
+            return value
+
+    def set(self, key, value):
+        size = len(value.encode('utf-8'))
+        if size > self.max_bytes:
+            return # Would evict everything else and still not fit
+        expires_at = time.monotonic() + self.ttl if self.ttl else None
+        with self._lock:
+            old = self._data.pop(key, None)
+            if old is not None:
+                self.current_bytes -= old[1]
+            self._data[key] = (value, size, expires_at)
+            self.current_bytes += size
+            while self.current_bytes > self.max_bytes:
+                _, (_, evicted_size, _) = self._data.popitem(last=False)
+                self.current_bytes -= evicted_size
+
+    def get_counter(self, key):
+        with self._lock:
+            return self._counters.get(key, 0)
+
+    def incr(self, key):
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + 1
+            return self._counters[key]
+
+
+class RedisCacheBackend:
+    """
+    Redis-backed cache shared by all workers. Eviction is left to the server
+    (configure `maxmemory` with an LRU `maxmemory-policy`); entries also get a TTL so
+    fragments for superseded versions don't linger.
+    """
+
+    def __init__(self, url='redis://localhost:6379/0', ttl=300, prefix='social-api:', **kwargs):
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError("USERS_CACHE_BACKEND='redis' requires the 'redis' package (pip install redis).")
+        self._client = redis.Redis.from_url(url)
+        self.ttl = ttl
+        self.prefix = prefix
+
+    def get(self, key):
+        value = self._client.get(self.prefix + key)
+        return value.decode('utf-8') if value is not None else None
+
+    def set(self, key, value):
+        self._client.set(self.prefix + key, value, ex=self.ttl)
+
+    def get_counter(self, key):
+        value = self._client.get(self.prefix + key)
+        return int(value) if value is not None else 0
+
+    def incr(self, key):
+        return self._client.incr(self.prefix + key)
+
+
+BACKENDS = {
+    'memory': MemoryCacheBackend,
+    'redis': RedisCacheBackend,
+}
+
+
+class UsersListingCache:
+    """
+    Versioned cache of /users/ listing fragments.
+
+    Every key embeds the global users version, so bumping the version (on register or
+    profile update) invalidates all cached pages at once; stale entries simply age out
+    of the backend.
+    """
+
+    def __init__(self, backend):
+        self.backend = backend
+
+    def version(self):
+        return self.backend.get_counter(USERS_VERSION_KEY)
+
+    def bump_version(self):
+        return self.backend.incr(USERS_VERSION_KEY)
+
+    def _key(self, version, search, page, per_page):
+        return f"users:v{version}:list:{json.dumps([search or '', page, per_page])}"
+
+    def get_fragment(self, version, search, page, per_page):
+        value = self.backend.get(self._key(version, search, page, per_page))
+        return json.loads(value) if value is not None else None
+
+    def set_fragment(self, version, search, page, per_page, fragment):
+        self.backend.set(self._key(version, search, page, per_page), json.dumps(fragment))
+
+
+def _resolve_backend_class(name):
+    if name in BACKENDS:
+        return BACKENDS[name]
+    # Otherwise a dotted path such as 'myproject.cache.MemcachedBackend'
+    module_name, _, class_name = name.rpartition('.')
+    if not module_name:
+        raise ValueError(f"Unknown USERS_CACHE_BACKEND: {name!r}")
+    return getattr(importlib.import_module(module_name), class_name)
+
+
+def get_users_cache():
+    return current_app.extensions.get('users_cache')
+
+
+def cached_listing_fragment(search, page, per_page, build):
+    """
+    The listing fragment for (search, page, per_page), from the cache or `build()`.
+    A failing backend (e.g. Redis down) is logged and the fragment built uncached.
+    """
+    cache = get_users_cache()
+    if cache is None:
+        return build()
+    try:
+        version = cache.version() # Read before building so a concurrent bump isn't masked
+        fragment = cache.get_fragment(version, search, page, per_page)
+    except Exception:
+        log_event(logging.WARNING, "users_cache_unavailable", exc_info=True, op='get')
+        return build()
+    if fragment is None:
+        fragment = build()
+        try:
+            cache.set_fragment(version, search, page, per_page, fragment)
+        except Exception:
+            log_event(logging.WARNING, "users_cache_unavailable", exc_info=True, op='set')
+    return fragment
+
+
+def bump_users_version():
+    # Runs after the write has committed, so a cache failure must not fail the request;
+    # cached pages then stay stale until they expire (USERS_CACHE_TTL)
+    cache = get_users_cache()
+    if cache is None:
+        return
+    try:
+        cache.bump_version()
+    except Exception:
+        log_event(logging.ERROR, "users_cache_bump_failed", exc_info=True)
+
+
+def init_app(app):
+    backend_name = app.config.get('USERS_CACHE_BACKEND', 'none')
+    if not backend_name or backend_name == 'none':
+        app.extensions['users_cache'] = None # Caching disabled
+        return
+
+    backend_class = _resolve_backend_class(backend_name)
+    backend = backend_class(
+        max_bytes=app.config.get('USERS_CACHE_MAX_BYTES', 16 * 1024 * 1024),
+        url=app.config.get('USERS_CACHE_REDIS_URL', 'redis://localhost:6379/0'),
+        ttl=app.config.get('USERS_CACHE_TTL', 300),
+    )
+    app.extensions['users_cache'] = UsersListingCache(backend)
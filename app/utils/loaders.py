@@ -0,0 +1,60 @@
+# app/utils/loaders.py
+from flask import g
+
+from ..models import User
+from .sharding import get_router
+
+
+class UserLoader:
+    """
+    Request-scoped batching loader for User rows by primary key.
+
+    Keys are queued with `queue()` and fetched together by `dispatch()` in a single
+    `WHERE id IN (...)` query per shard. Results (including misses, cached as None) are
+    kept for the rest of the request, so each user is fetched at most once.
+    """
+
+    def __init__(self):
+        self._cache = {}
+        self._pending = set()
+
+    def queue(self, ids):
+        for user_id in ids:
+            if user_id is not None and user_id not in self._cache:
+                self._pending.add(user_id)
+
+    def dispatch(self):
+        if not self._pending:
+            return
+        pending, self._pending = self._pending, set()
+        router = get_router()
+        by_shard = {}
+        for user_id in pending:
+            by_shard.setdefault(router.shard_for_user(user_id), []).append(user_id)
+
+        found = {}
+        for shard, ids in by_shard.items():
+            for user in router.session(shard).query(User).filter(User.id.in_(ids)).all():
+                found[user.id] = user
+        for user_id in pending:
+            self._cache[user_id] = found.get(user_id)
+
+    def load(self, user_id):
+        if user_id is None:
+            return None
+        if user_id not in self._cache:
+            self.queue([user_id])
+            self.dispatch() # Also flushes anything else queued in the meantime
+        return self._cache[user_id]
+
+    def load_many(self, ids):
+        self.queue(ids)
+        self.dispatch()
+        return [self._cache.get(user_id) for user_id in ids]
+
+
+def get_user_loader():
+    # `g` lives for one app context, i.e. one request
+    if 'user_loader' not in g:
+        g.user_loader = UserLoader()
+    return g.user_loader
@@ -0,0 +1,167 @@
+# app/utils/log.py
+import atexit
+import json
+import logging
+import os
+import queue
+import random
+import sys
+import weakref
+from logging.handlers import QueueHandler, QueueListener
+
+from flask import current_app, g, has_request_context, request
+from flask.logging import default_handler
+
+
+class DeferredQueueHandler(QueueHandler):
+    """
+    QueueHandler that leaves formatting of `log_event` records to the listener thread.
+
+    The stock handler formats the message in the caller's thread before enqueueing;
+    records from `log_event` only carry plain values (ints, strings), so they can cross
+    threads as-is and be rendered by the background listener. Other records may hold
+    mutable arguments that could change before the listener gets to them, so they still
+    go through the stock `prepare`.
+    """
+
+    def prepare(self, record):
+        if getattr(record, 'fields', None) is not None:
+            return record
+        return super().prepare(record)
+
+
+class StructuredFormatter(logging.Formatter):
+    """Renders the record's `fields` as key=value pairs (text) or one JSON object per line."""
+
+    def __init__(self, fmt_type='text'):
+        super().__init__()
+        self.fmt_type = fmt_type
+
+    def format(self, record):
+        fields = getattr(record, 'fields', None) or {}
+        message = record.getMessage()
+        if self.fmt_type == 'json':
+            payload = {'ts': self.formatTime(record), 'level': record.levelname,
+                       'logger': record.name, 'event': message, **fields}
+            if record.exc_info:
+                payload['exc'] = self.formatException(record.exc_info)
+            return json.dumps(payload, default=str)
+
+        line = f"{self.formatTime(record)} {record.levelname} {record.name} {message}"
+        if fields:
+            line += ' ' + ' '.join(f"{key}={value}" for key, value in fields.items())
+        if record.exc_info:
+            line += '\n' + self.formatException(record.exc_info)
+        return line
+
+
+def _sampled_out(level):
+    # Warnings and errors are never sampled; verbose requests are never sampled
+    if level >= logging.WARNING or not has_request_context():
+        return False
+    return not g.get('log_verbose', False) and not g.get('log_sampled', True)
+
+
+class SamplingFilter(logging.Filter):
+    """Applies the per-request sampling decision to plain `logger.info()` calls too."""
+
+    def filter(self, record):
+        return not _sampled_out(record.levelno)
+
+
+def log_event(level, event, exc_info=None, **fields):
+    """
+    Log `event` with structured `fields` on the app logger.
+
+    Level-gated and sampled before a record is even built; a request carrying the
+    debug header bypasses both, so DEBUG diagnostics can be switched on per request.
+    """
+    logger = current_app.logger
+    verbose = has_request_context() and g.get('log_verbose', False)
+    if not verbose and (not logger.isEnabledFor(level) or _sampled_out(level)):
+        return
+
+    if has_request_context():
+        fields.setdefault('endpoint', request.endpoint)
+    if exc_info is True:
+        exc_info = sys.exc_info()
+    record = logger.makeRecord(logger.name, level, '(log_event)', 0, event, (), exc_info,
+                               extra={'fields': fields})
+    logger.handle(record) # Skips the logger level check, which `verbose` may have bypassed
+
+
+# Queue handlers of every live app. The atexit and fork hooks below are registered once
+# per process and work over this registry, so creating more apps adds no more hooks.
+_live_handlers = weakref.WeakSet()
+
+
+def _start_listener(handler):
+    handler.queue = queue.SimpleQueue()
+    stream = logging.StreamHandler()
+    stream.setFormatter(StructuredFormatter(handler.fmt_type))
+    handler.listener = QueueListener(handler.queue, stream, respect_handler_level=True)
+    handler.listener.start()
+
+
+def _stop_listener(handler):
+    listener, handler.listener = handler.listener, None
+    if listener is not None:
+        listener.stop() # Flushes what's queued
+
+
+def _stop_all_listeners():
+    for handler in list(_live_handlers):
+        _stop_listener(handler)
+
+
+def _restart_listeners_in_child():
+    # Listener threads don't survive fork (prefork servers with preload): give each
+    # child a fresh queue and listener per live handler
+    for handler in list(_live_handlers):
+        _start_listener(handler)
+
+
+atexit.register(_stop_all_listeners)
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_restart_listeners_in_child)
+
+
+def _log_level(app):
+    level = str(app.config.get('LOG_LEVEL', 'INFO')).upper()
+    if not isinstance(logging.getLevelName(level), int):
+        logging.getLogger(__name__).warning("Unknown LOG_LEVEL %r; using INFO.", level)
+        return 'INFO'
+    return level
+
+
+def _choose_sampling(app):
+    rate = app.config.get('LOG_SAMPLE_RATES', {}).get(request.endpoint, 1.0)
+    g.log_sampled = rate >= 1.0 or random.random() < rate
+
+    header = app.config.get('LOG_DEBUG_HEADER')
+    token = app.config.get('LOG_DEBUG_TOKEN')
+    # Only honoured when a token is configured, so clients can't switch on verbose logs
+    g.log_verbose = bool(token) and request.headers.get(header) == token
+
+
+def init_app(app):
+    app.logger.removeHandler(default_handler)
+    app.logger.setLevel(_log_level(app))
+    app.logger.propagate = False
+
+    # Apps share their logger by name; retire handlers left by an earlier create_app
+    for old in [h for h in app.logger.handlers if isinstance(h, DeferredQueueHandler)]:
+        app.logger.removeHandler(old)
+        _live_handlers.discard(old)
+        _stop_listener(old)
+
+    handler = DeferredQueueHandler(queue.SimpleQueue())
+    handler.fmt_type = app.config.get('LOG_FORMAT', 'text')
+    handler.listener = None
+    handler.addFilter(SamplingFilter())
+    _start_listener(handler)
+    _live_handlers.add(handler)
+    app.logger.addHandler(handler)
+    app.extensions['log_queue_handler'] = handler
+
+    app.before_request(lambda: _choose_sampling(app))
@@ -0,0 +1,231 @@
+# app/utils/outbox.py
+import json
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+
+import click
+from flask import current_app
+from flask.cli import AppGroup
+from sqlalchemy import func, select
+
+from ..models import OutboxEvent
+from .log import log_event
+from .sharding import get_router
+
+
+def record_event(session, event_type, user_id, entity_type, entity_id, **payload):
+    """
+    Stage an outbox row in `session`; it commits (or rolls back) with the change itself.
+    A no-op unless OUTBOX_ENABLED, so nothing piles up when no dispatcher will drain it.
+    """
+    if not current_app.config.get('OUTBOX_ENABLED', False):
+        return
+    session.add(OutboxEvent(user_id=user_id, event_type=event_type, entity_type=entity_type,
+                            entity_id=entity_id, payload=json.dumps(payload) if payload else None))
+
+
+def record_user_event(event_type, user):
+    record_event(get_router().session_for_user(user.id), event_type, user.id, 'user', user.id)
+
+
+def record_friend_request_event(event_type, friend_request):
+    # One row per endpoint, each on that user's shard (the same session when unsharded)
+    router = get_router()
+    for user_id in (friend_request.requester_id, friend_request.recipient_id):
+        record_event(router.session_for_user(user_id), event_type, user_id, 'friend_request', friend_request.id,
+                     requester_id=friend_request.requester_id, recipient_id=friend_request.recipient_id,
+                     status=friend_request.status.value)
+
+
+def coalesce(rows):
+    """
+    Group outbox rows by user, keeping only the latest event per entity (e.g. a request
+    that was sent and then accepted in the same batch is delivered once, as accepted).
+    Returns {user_id: (events, row_ids)}; row_ids covers every row folded into events.
+    """
+    grouped = {}
+    for row in rows: # Ordered by id, so later rows win
+        latest, row_ids = grouped.setdefault(row.user_id, ({}, []))
+        latest[(row.entity_type, row.entity_id)] = {
+            'type': row.event_type,
+            'entity_type': row.entity_type,
+            'entity_id': row.entity_id,
+            'payload': json.loads(row.payload) if row.payload else {},
+            'created_at': row.created_at,
+        }
+        row_ids.append(row.id)
+    return {user_id: (list(latest.values()), row_ids) for user_id, (latest, row_ids) in grouped.items()}
+
+
+class OutboxDispatcher:
+    """
+    Polls the outbox on every shard and fans coalesced events out to in-process
+    subscribers (`fn(user_id, events)`).
+
+    Delivery is at-least-once: rows are marked dispatched only after every subscriber
+    returned for that user, so a failure (or a crash mid-batch) means redelivery. A failed
+    user's rows are retried with exponential backoff (`retry_base_seconds`, doubling up to
+    `retry_max_seconds`); until then none of that user's events are delivered, so a
+    failure doesn't let later events overtake it.
+
+    That is the only ordering guarantee. Rows are claimed with SKIP LOCKED, so when several
+    dispatchers run (one per worker) a user's events can be split across them, delivered
+    out of order and coalesced separately. Run a single dispatcher if order matters.
+    """
+
+    def __init__(self, batch_size=200, poll_seconds=1.0, retry_base_seconds=5.0, retry_max_seconds=300.0):
+        self.batch_size = batch_size
+        self.poll_seconds = poll_seconds
+        self.retry_base_seconds = retry_base_seconds
+        self.retry_max_seconds = retry_max_seconds
+        self.subscribers = []
+        self.stats = {'dispatched': 0, 'failed': 0, 'last_lag_seconds': None, 'max_lag_seconds': 0.0}
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def subscribe(self, fn):
+        self.subscribers.append(fn)
+        return fn # Usable as a decorator
+
+    def retry_delay(self, attempts):
+        return min(self.retry_base_seconds * 2 ** (attempts - 1), self.retry_max_seconds)
+
+    def dispatch_once(self):
+        """Deliver up to `batch_size` due events per shard. Returns the number delivered."""
+        router = get_router()
+        total_delivered = 0
+        for shard in range(router.num_shards):
+            session = router.session(shard)
+            now = datetime.utcnow()
+            # Users with a failed delivery still waiting for its retry time are skipped whole
+            backing_off = select(OutboxEvent.user_id).where(
+                OutboxEvent.dispatched_at.is_(None), OutboxEvent.next_attempt_at > now
+            )
+            # SKIP LOCKED keeps concurrent dispatchers (one per worker) off each other's rows
+            rows = session.query(OutboxEvent).filter(
+                OutboxEvent.dispatched_at.is_(None),
+                OutboxEvent.user_id.notin_(backing_off)
+            ).order_by(OutboxEvent.id).limit(self.batch_size).with_for_update(skip_locked=True).all()
+            if not rows:
+                session.commit() # End the transaction
+                continue
+
+            delivered_ids = []
+            for user_id, (events, row_ids) in coalesce(rows).items():
+                try:
+                    for subscriber in self.subscribers:
+                        subscriber(user_id, events)
+                    delivered_ids.extend(row_ids)
+                except Exception:
+                    attempts = max(row.attempts for row in rows if row.user_id == user_id) + 1
+                    session.query(OutboxEvent).filter(OutboxEvent.id.in_(row_ids)).update(
+                        {OutboxEvent.attempts: attempts,
+                         OutboxEvent.next_attempt_at: now + timedelta(seconds=self.retry_delay(attempts))},
+                        synchronize_session=False)
+                    self.stats['failed'] += len(row_ids)
+                    log_event(logging.ERROR, "outbox_delivery_failed", exc_info=True, user_id=user_id,
+                              shard=shard, attempts=attempts)
+
+            now = datetime.utcnow()
+            if delivered_ids:
+                session.query(OutboxEvent).filter(OutboxEvent.id.in_(delivered_ids)).update(
+                    {OutboxEvent.dispatched_at: now}, synchronize_session=False)
+            session.commit()
+            total_delivered += len(delivered_ids)
+
+            # Lag: time from the oldest event in the batch being written to it being delivered
+            lag = (now - min(row.created_at for row in rows)).total_seconds()
+            self.stats['dispatched'] += len(delivered_ids)
+            self.stats['last_lag_seconds'] = lag
+            self.stats['max_lag_seconds'] = max(self.stats['max_lag_seconds'], lag)
+        return total_delivered
+
+    def backlog(self):
+        """(undispatched events, age in seconds of the oldest one) across all shards."""
+        count, oldest = 0, None
+        for shard_count, shard_oldest in get_router().scatter(lambda session: session.query(
+                func.count(OutboxEvent.id), func.min(OutboxEvent.created_at)
+        ).filter(OutboxEvent.dispatched_at.is_(None)).one()):
+            count += shard_count
+            if shard_oldest is not None and (oldest is None or shard_oldest < oldest):
+                oldest = shard_oldest
+        age = (datetime.utcnow() - oldest).total_seconds() if oldest is not None else 0.0
+        return count, age
+
+    def ensure_started(self, app):
+        # Started lazily (first request) and per process, so forked workers get their own thread
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            threading.Thread(target=self._run, args=(app,), name='outbox-dispatcher', daemon=True).start()
+
+    def _run(self, app):
+        while True:
+            delivered = 0
+            with app.app_context():
+                try:
+                    delivered = self.dispatch_once()
+                except Exception:
+                    log_event(logging.ERROR, "outbox_dispatch_failed", exc_info=True)
+            if delivered < self.batch_size: # Caught up (or only failures); otherwise go again immediately
+                time.sleep(self.poll_seconds)
+
+
+def get_dispatcher():
+    return current_app.extensions['outbox_dispatcher']
+
+
+def subscribe(fn):
+    """Register `fn(user_id, events)` on the current app's dispatcher."""
+    return get_dispatcher().subscribe(fn)
+
+
+outbox_cli = AppGroup('outbox', help='Inspect and drive the event outbox.')
+
+
+@outbox_cli.command('dispatch')
+def dispatch_command():
+    """Deliver pending events once (e.g. from cron when the background thread is off)."""
+    dispatcher = get_dispatcher()
+    while dispatcher.dispatch_once() >= dispatcher.batch_size:
+        pass
+    click.echo(f"Dispatched {dispatcher.stats['dispatched']} events ({dispatcher.stats['failed']} failed).")
+
+
+@outbox_cli.command('stats')
+def stats_command():
+    """Show the undispatched backlog and the age of its oldest event (the lag)."""
+    count, age = get_dispatcher().backlog()
+    click.echo(f"pending={count} oldest_pending_age_seconds={age:.1f}")
+
+
+@outbox_cli.command('purge')
+@click.option('--older-than-hours', default=24, show_default=True, help='Delete dispatched events older than this.')
+def purge_command(older_than_hours):
+    """Delete dispatched events older than the cutoff (undispatched ones are always kept)."""
+    cutoff = datetime.utcnow() - timedelta(hours=older_than_hours)
+    deleted = 0
+    for session in get_router().scatter(lambda session: session):
+        deleted += session.query(OutboxEvent).filter(
+            OutboxEvent.dispatched_at.isnot(None), OutboxEvent.dispatched_at < cutoff
+        ).delete(synchronize_session=False)
+        session.commit()
+    click.echo(f"Deleted {deleted} dispatched events.")
+
+
+def init_app(app):
+    dispatcher = OutboxDispatcher(batch_size=app.config.get('OUTBOX_BATCH_SIZE', 200),
+                                  poll_seconds=app.config.get('OUTBOX_POLL_SECONDS', 1.0),
+                                  retry_base_seconds=app.config.get('OUTBOX_RETRY_BASE_SECONDS', 5.0),
+                                  retry_max_seconds=app.config.get('OUTBOX_RETRY_MAX_SECONDS', 300.0))
+    app.extensions['outbox_dispatcher'] = dispatcher
+    app.cli.add_command(outbox_cli)
+
+    if app.config.get('OUTBOX_DISPATCHER_ENABLED', False):
+        app.before_request(lambda: dispatcher.ensure_started(app))
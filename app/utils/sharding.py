@@ -0,0 +1,184 @@
+# app/utils/sharding.py
+import zlib
+
+import click
+from flask import current_app, g
+from flask.cli import AppGroup
+from sqlalchemy import inspect, insert
+from sqlalchemy.orm import Session
+from sqlalchemy.schema import CreateIndex, CreateTable
+
+from ..extensions import db
+from ..models import ShardSequence
+
+
+class ShardRouter:
+    """
+    Routes users and friend requests to one of N databases.
+
+    Shard 0 is the default database (SQLALCHEMY_DATABASE_URI, served by `db.session`);
+    shards 1..N-1 come from SQLALCHEMY_SHARD_URIS. With no extra URIs N is 1 and every
+    call resolves to `db.session`, so unsharded deployments behave exactly as before.
+
+    - A user lives on `crc32(email) % N`, so login by email touches one shard.
+    - User IDs are minted as `seq * N + shard`, so `user_id % N` recovers the shard.
+    - A friend request is minted on the requester's shard and mirrored to the recipient's
+      shard under the same ID, so each user's requests (sent and received) can be read
+      from their own shard alone.
+    """
+
+    def __init__(self, num_shards):
+        self.num_shards = num_shards
+
+    @property
+    def sharded(self):
+        return self.num_shards > 1
+
+    def shard_for_id(self, record_id):
+        # Holds for every ID minted by allocate_id (users and friend requests alike)
+        return int(record_id) % self.num_shards
+
+    def shard_for_user(self, user_id):
+        return self.shard_for_id(user_id)
+
+    def shard_for_email(self, email):
+        return zlib.crc32(email.strip().lower().encode('utf-8')) % self.num_shards
+
+    def engine(self, shard):
+        return db.engine if shard == 0 else db.engines[f'shard{shard}']
+
+    def session(self, shard):
+        if shard == 0:
+            return db.session
+        sessions = g.setdefault('shard_sessions', {})
+        if shard not in sessions:
+            sessions[shard] = Session(bind=self.engine(shard))
+        return sessions[shard]
+
+    def session_for_user(self, user_id):
+        return self.session(self.shard_for_user(user_id))
+
+    def sessions_for_pair(self, user_a, user_b):
+        # Deduplicated, in (user_a, user_b) order
+        shards = dict.fromkeys([self.shard_for_user(user_a), self.shard_for_user(user_b)])
+        return [self.session(shard) for shard in shards]
+
+    def scatter(self, fn):
+        """Call `fn(session)` on every shard and return the results in shard order."""
+        return [fn(self.session(shard)) for shard in range(self.num_shards)]
+
+    def allocate_id(self, shard):
+        """New primary key that maps back to `shard`, or None to use autoincrement."""
+        if not self.sharded:
+            return None
+        result = self.session(shard).execute(insert(ShardSequence))
+        return result.inserted_primary_key[0] * self.num_shards + shard
+
+
+def get_router():
+    return current_app.extensions['shard_router']
+
+
+def commit_sessions(sessions):
+    # No two-phase commit across shards: if a later commit fails, earlier shards keep
+    # their write. Mirrors are repaired from the home copy by the next send (before its
+    # 409), accept or reject touching the same pair.
+    try:
+        for session in sessions:
+            session.commit()
+    except Exception:
+        for session in sessions:
+            session.rollback()
+        raise
+
+
+def rollback_sessions(sessions):
+    for session in sessions:
+        session.rollback()
+
+
+def configure_binds(app):
+    """Register shard URIs as SQLAlchemy binds. Must run before `db.init_app`."""
+    binds = dict(app.config.get('SQLALCHEMY_BINDS') or {})
+    for shard, uri in enumerate(app.config.get('SQLALCHEMY_SHARD_URIS') or [], start=1):
+        binds[f'shard{shard}'] = uri
+    app.config['SQLALCHEMY_BINDS'] = binds
+
+
+shards_cli = AppGroup('shards', help='Manage database shards.')
+
+
+def _alembic_config():
+    return current_app.extensions['migrate'].migrate.get_config()
+
+
+def _run_alembic(shard, fn):
+    # env.py picks the connection up from the config, so Alembic runs against this shard
+    from alembic import command
+    config = _alembic_config()
+    with get_router().engine(shard).begin() as conn:
+        config.attributes['connection'] = conn
+        fn(command, config)
+
+
+@shards_cli.command('create-schema')
+def create_schema_command():
+    """Create missing tables on every shard, without foreign keys to `users`."""
+    router = get_router()
+    for shard in range(router.num_shards):
+        with router.engine(shard).begin() as conn:
+            existing = set(inspect(conn).get_table_names())
+            for table in db.metadata.sorted_tables:
+                if table.name in existing:
+                    continue
+                # Mirrored friend requests and blocklist rows reference users on other shards
+                conn.execute(CreateTable(table, include_foreign_key_constraints=[]))
+                for index in table.indexes:
+                    conn.execute(CreateIndex(index))
+
+        if 'alembic_version' in existing:
+            click.echo(f"Shard {shard}: schema up to date (use `flask shards upgrade` for new migrations).")
+        elif existing & set(db.metadata.tables):
+            # Tables from before migrations were tracked here; their revision isn't known
+            click.echo(f"Shard {shard}: tables created, but existing ones have no migration version; "
+                       f"run `flask shards stamp <revision they were created at>` then `flask shards upgrade`.")
+        else:
+            # Freshly created from the current models, i.e. at the latest migration
+            _run_alembic(shard, lambda command, config: command.stamp(config, 'head'))
+            click.echo(f"Shard {shard}: schema created and stamped at head.")
+
+
+@shards_cli.command('upgrade')
+@click.argument('revision', default='head')
+def upgrade_command(revision):
+    """Apply Alembic migrations to every shard (schemas must come from create-schema)."""
+    router = get_router()
+    for shard in range(router.num_shards):
+        with router.engine(shard).connect() as conn:
+            tracked = 'alembic_version' in inspect(conn).get_table_names()
+        if not tracked:
+            # Running the initial migration here would add foreign keys mirrored rows violate
+            raise click.ClickException(f"Shard {shard} has no migration version; run `flask shards create-schema` "
+                                       f"(or `flask shards stamp`) first.")
+        _run_alembic(shard, lambda command, config: command.upgrade(config, revision))
+        click.echo(f"Shard {shard}: upgraded to {revision}.")
+
+
+@shards_cli.command('stamp')
+@click.argument('revision')
+def stamp_command(revision):
+    """Record `revision` as applied on every shard without running migrations."""
+    router = get_router()
+    for shard in range(router.num_shards):
+        _run_alembic(shard, lambda command, config: command.stamp(config, revision))
+        click.echo(f"Shard {shard}: stamped at {revision}.")
+
+
+def init_app(app):
+    app.extensions['shard_router'] = ShardRouter(1 + len(app.config.get('SQLALCHEMY_SHARD_URIS') or []))
+    app.cli.add_command(shards_cli)
+
+    @app.teardown_appcontext
+    def close_shard_sessions(exc):
+        for session in g.pop('shard_sessions', {}).values():
+            session.close()
@@ -0,0 +1,113 @@
+# app/utils/warmup.py
+import os
+import time
+
+from flask_jwt_extended import create_access_token, decode_token
+from sqlalchemy import text
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import configure_mappers
+
+from ..models import User, FriendRequest, FriendRequestStatus
+from .blocklist import get_revoked_filter
+from .sharding import get_router
+
+
+def _engines(app):
+    with app.app_context():
+        router = get_router()
+        return [router.engine(shard) for shard in range(router.num_shards)]
+
+
+def warm_connection_pool(app, size=None):
+    """Open (and return to the pool) `size` connections per engine."""
+    size = size if size is not None else app.config.get('PRELOAD_POOL_WARM_SIZE', 1)
+    for engine in _engines(app):
+        conns = [engine.connect() for _ in range(size)]
+        for conn in conns:
+            conn.execute(text('SELECT 1'))
+            conn.close()
+
+
+def dispose_pools_after_fork(app):
+    # close=False: leave the parent's sockets alone, just stop this process using them
+    for engine in _engines(app):
+        engine.dispose(close=False)
+
+
+def warm_revoked_filter(app):
+    # Builds the token blocklist Bloom filter, which would otherwise cost the first
+    # authenticated request a token_blocklist query plus the build
+    with app.app_context():
+        try:
+            get_revoked_filter().refresh_if_stale()
+        except SQLAlchemyError:
+            # e.g. migrations not applied yet; the first request builds it instead
+            app.logger.warning("Could not build the revoked-token filter during warm-up.", exc_info=True)
+
+
+def _warm_schemas(app):
+    from ..schemas import (user_public_schema, users_public_schema, user_profile_schema,
+                           user_register_schema, user_login_schema, user_update_schema,
+                           friend_requests_schema)
+
+    now_user = User(id=0, name='warmup', email='warmup@example.com', bio=None)
+    # requester_id/recipient_id left unset so the user loader has nothing to fetch
+    request_obj = FriendRequest(id=0, status=FriendRequestStatus.PENDING)
+    with app.test_request_context():
+        user_public_schema.dump(now_user)
+        users_public_schema.dump([now_user])
+        user_profile_schema.dump(now_user)
+        friend_requests_schema.dump([request_obj])
+        user_register_schema.load({'name': 'warmup', 'email': 'warmup@example.com', 'password': 'warmup-pw'})
+        user_login_schema.load({'email': 'warmup@example.com', 'password': 'warmup-pw'})
+        user_update_schema.load({'bio': None}, partial=True)
+
+
+def _warm_routing_and_jwt(app):
+    adapter = app.url_map.bind('localhost') # Builds the URL matcher
+    adapter.match('/users/profile', method='GET')
+    with app.app_context():
+        decode_token(create_access_token(identity='0'))
+
+
+def warm_up(app):
+    """
+    Do the work a fresh worker would otherwise do on its first request: configure
+    mappers, exercise every schema, compile the URL map, sign/verify a JWT, build the
+    revoked-token filter and open the database pool. Returns {step: seconds}.
+    """
+    steps = [
+        ('mappers', lambda: configure_mappers()),
+        ('schemas', lambda: _warm_schemas(app)),
+        ('routing_jwt', lambda: _warm_routing_and_jwt(app)),
+        ('blocklist', lambda: warm_revoked_filter(app)),
+        ('pool', lambda: warm_connection_pool(app)),
+    ]
+    timings = {}
+    for name, step in steps:
+        started = time.perf_counter()
+        step()
+        timings[name] = time.perf_counter() - started
+    return timings
+
+
+def preload(app, import_seconds, create_seconds):
+    """
+    Warm `app` in the parent process before workers are forked, and make sure each
+    child gets its own database connections.
+    """
+    timings = {'import': import_seconds, 'create_app': create_seconds}
+    timings.update(warm_up(app))
+
+    if hasattr(os, 'register_at_fork'):
+        os.register_at_fork(after_in_child=lambda: dispose_pools_after_fork(app))
+
+    app.extensions['startup_timings'] = timings
+    total_ms = sum(timings.values()) * 1000
+    app.logger.info("Preload finished in %.1f ms (%s)", total_ms,
+                    ', '.join(f"{name}={seconds * 1000:.1f}ms" for name, seconds in timings.items()))
+
+    budget_ms = app.config.get('STARTUP_BUDGET_MS')
+    if budget_ms and total_ms > budget_ms:
+        app.logger.warning("Startup took %.1f ms, over the %d ms budget.", total_ms, budget_ms)
+    return timings
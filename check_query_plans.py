@@ -0,0 +1,390 @@
+# check_query_plans.py
+"""
+Query-plan and query-count regression check.
+
+Seeds a scratch database, drives every route in auth.py, users.py and friends.py,
+captures the SQL each one emits, runs EXPLAIN / EXPLAIN QUERY PLAN on it and fails
+(exit code 1) when a route:
+
+- full-scans `users` or `friend_requests` above the row threshold, unless that exact
+  statement (by fingerprint) is listed under the route's `allowed_scans`, or
+- issues more queries than its `max_queries` budget from query_budgets.json.
+
+    python check_query_plans.py                # check against a temporary SQLite file
+    python check_query_plans.py --record       # accept current query counts as budgets
+    python check_query_plans.py --database-uri mysql+pymysql://.../scratch_db
+    python check_query_plans.py --shards 3     # sharded run over 3 temporary SQLite files
+
+A sharded run creates the shard schemas with `flask shards create-schema`, checks
+statuses and scans (query budgets are for the unsharded layout) and then verifies
+routing, mirroring and the scatter-gather listing and suggestions.
+
+Never point --database-uri at a real database: tables are created and seeded.
+"""
+import argparse
+import json
+import math
+import os
+import re
+import sys
+import tempfile
+from contextlib import contextmanager
+from datetime import datetime
+
+from flask_jwt_extended import create_access_token
+from sqlalchemy import event, func
+from werkzeug.security import generate_password_hash
+
+from app import create_app
+from app.config import Config
+from app.extensions import db
+from app.models import User, FriendRequest, FriendRequestStatus
+from app.utils.sharding import get_router
+from app.utils.warmup import warm_revoked_filter
+
+DEFAULT_BUDGETS = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'query_budgets.json')
+WATCHED_TABLES = ('users', 'friend_requests')
+SEED_PASSWORD = 'password123'
+
+_COLUMN_LIST = re.compile(r'\w+\.\w+ AS \w+(?:, \w+\.\w+ AS \w+)*')
+_PLACEHOLDER = re.compile(r'%\(\w+\)s|%s')
+_PLACEHOLDER_LIST = re.compile(r'\(\?(?:, \?)+\)')
+
+
+def fingerprint(statement):
+    """
+    Normalised form of `statement` used to key `allowed_scans`: whitespace collapsed,
+    selected column lists replaced by <columns>, placeholders unified to `?` and IN
+    lists collapsed, so the same query matches whatever its parameters.
+    """
+    sql = ' '.join(statement.split())
+    sql = _COLUMN_LIST.sub('<columns>', sql)
+    sql = _PLACEHOLDER.sub('?', sql)
+    return _PLACEHOLDER_LIST.sub('(?)', sql)
+
+
+@contextmanager
+def record_queries(engines):
+    """Collect (engine, statement, parameters) for every statement run on `engines`."""
+    captured = []
+    listeners = []
+    for engine in engines:
+        def before_cursor_execute(conn, cursor, statement, parameters, context, executemany, engine=engine):
+            captured.append((engine, statement, parameters))
+        event.listen(engine, 'before_cursor_execute', before_cursor_execute)
+        listeners.append((engine, before_cursor_execute))
+    try:
+        yield captured
+    finally:
+        for engine, listener in listeners:
+            event.remove(engine, 'before_cursor_execute', listener)
+
+
+def explain_scans(engine, statement, parameters, table_rows):
+    """
+    Return [(table, rows)] for each full scan of a watched table in `statement`'s plan.
+    `table_rows` maps table name to its row count, used when the plan has no estimate.
+    """
+    if not statement.lstrip().upper().startswith(('SELECT', 'UPDATE', 'DELETE', 'WITH')):
+        return []
+
+    scans = []
+    with engine.connect() as conn:
+        if engine.dialect.name == 'sqlite':
+            # Rows look like (id, parent, notused, 'SCAN users' / 'SEARCH users USING ...')
+            for row in conn.exec_driver_sql('EXPLAIN QUERY PLAN ' + statement, parameters):
+                words = row[-1].split()
+                if len(words) >= 2 and words[0] == 'SCAN' and words[1] in WATCHED_TABLES:
+                    scans.append((words[1], table_rows.get(words[1], 0)))
+        else:
+            # MySQL: access type ALL is a table scan, index is a full index scan
+            for row in conn.exec_driver_sql('EXPLAIN ' + statement, parameters).mappings():
+                if row.get('table') in WATCHED_TABLES and row.get('type') in ('ALL', 'index'):
+                    scans.append((row['table'], int(row.get('rows') or 0)))
+    return scans
+
+
+def seed_database(num_users=500, requests_per_user=3):
+    """Bulk-insert users and a mix of friend requests through the shard router."""
+    router = get_router()
+    password_hash = generate_password_hash(SEED_PASSWORD) # Hashing is slow; reuse one
+    now = datetime.utcnow()
+
+    user_ids = []
+    for i in range(num_users):
+        email = f'seed{i}@example.com'
+        shard = router.shard_for_email(email)
+        user = User(id=router.allocate_id(shard), name=f'Seed User {i}', email=email,
+                    password_hash=password_hash, bio=None, created_at=now, updated_at=now)
+        session = router.session(shard)
+        session.add(user)
+        session.flush()
+        user_ids.append(user.id)
+
+    statuses = [FriendRequestStatus.ACCEPTED, FriendRequestStatus.PENDING, FriendRequestStatus.REJECTED]
+    for i, requester_id in enumerate(user_ids):
+        for offset in range(1, requests_per_user + 1):
+            recipient_id = user_ids[(i + offset) % len(user_ids)]
+            fields = dict(requester_id=requester_id, recipient_id=recipient_id,
+                          status=statuses[(i + offset) % len(statuses)], created_at=now, updated_at=now)
+            home = router.session_for_user(requester_id)
+            friend_request = FriendRequest(id=router.allocate_id(router.shard_for_user(requester_id)), **fields)
+            home.add(friend_request)
+            home.flush()
+            for session in router.sessions_for_pair(requester_id, recipient_id):
+                if session is not home: # Mirror copy on the recipient's shard
+                    session.add(FriendRequest(id=friend_request.id, **fields))
+
+    for shard in range(router.num_shards):
+        router.session(shard).commit()
+    return user_ids
+
+
+def _auth(user_id):
+    return {'Authorization': 'Bearer ' + create_access_token(identity=str(user_id))}
+
+
+def _pending_request_to(client, requester_id, recipient_id):
+    # Fresh pending request for the accept/reject routes, created outside the measurement
+    resp = client.post(f'/friend-requests/send/{recipient_id}', headers=_auth(requester_id))
+    return resp.get_json()['request']['id']
+
+
+def build_scenarios(user_ids):
+    """
+    (route name, setup, call) for every route. `setup(client)` runs unmeasured and
+    returns the argument passed to `call(client, arg)`.
+    """
+    count = len(user_ids)
+    actor, other = user_ids[0], user_ids[count // 2]
+    stranger_a, stranger_b = user_ids[count // 3], user_ids[2 * count // 3]
+    # Senders for /incoming, so it has requesters to load (none of them know the actor yet)
+    senders = [user_ids[count // 4], user_ids[3 * count // 4]]
+    fresh_email = 'query-plan-check@example.com'
+
+    return [
+        ('POST /auth/register', None,
+         lambda c, _: c.post('/auth/register', json={'name': 'Plan Check', 'email': fresh_email, 'password': SEED_PASSWORD})),
+        ('POST /auth/login', None,
+         lambda c, _: c.post('/auth/login', json={'email': 'seed0@example.com', 'password': SEED_PASSWORD})),
+        ('GET /users/profile', None,
+         lambda c, _: c.get('/users/profile', headers=_auth(actor))),
+        ('PUT /users/profile', None,
+         lambda c, _: c.put('/users/profile', json={'bio': 'Checking query plans'}, headers=_auth(actor))),
+        ('GET /users/', None,
+         lambda c, _: c.get('/users/?page=3&per_page=10', headers=_auth(actor))),
+        ('GET /users/?search=', None,
+         lambda c, _: c.get('/users/?search=User 4&per_page=10', headers=_auth(actor))),
+        ('GET /users/batch', None,
+         lambda c, _: c.get('/users/batch?ids=' + ','.join(str(uid) for uid in user_ids[:20]), headers=_auth(actor))),
+        ('GET /users/suggestions', None,
+         lambda c, _: c.get('/users/suggestions', headers=_auth(actor))),
+        ('POST /friend-requests/send/<id>', None,
+         lambda c, _: c.post(f'/friend-requests/send/{other}', headers=_auth(actor))),
+        ('PUT /friend-requests/<id>/accept', lambda c: _pending_request_to(c, stranger_a, actor),
+         lambda c, request_id: c.put(f'/friend-requests/{request_id}/accept', headers=_auth(actor))),
+        ('PUT /friend-requests/<id>/reject', lambda c: _pending_request_to(c, stranger_b, actor),
+         lambda c, request_id: c.put(f'/friend-requests/{request_id}/reject', headers=_auth(actor))),
+        ('GET /friend-requests/incoming', lambda c: [_pending_request_to(c, sender, actor) for sender in senders],
+         lambda c, _: c.get('/friend-requests/incoming', headers=_auth(actor))),
+        ('GET /friend-requests/list', None,
+         lambda c, _: c.get('/friend-requests/list', headers=_auth(actor))),
+        ('POST /auth/logout', None,
+         lambda c, _: c.post('/auth/logout', headers=_auth(actor))),
+    ]
+
+
+def _scan_allowed(allowed, table, statement_fingerprint):
+    return any(entry.get('table') == table and entry.get('statement') == statement_fingerprint
+               for entry in allowed)
+
+
+def run_checks(app, budgets, row_threshold):
+    """
+    Run every scenario and return a list of per-route result dicts with keys
+    route, status, queries, max_queries, scans and failures.
+    """
+    router = get_router()
+    engines = [router.engine(shard) for shard in range(router.num_shards)]
+    user_ids = seed_database()
+
+    table_rows = {}
+    for table, model in (('users', User), ('friend_requests', FriendRequest)):
+        table_rows[table] = sum(router.scatter(lambda session: session.query(func.count(model.id)).scalar()))
+
+    client = app.test_client()
+    warm_revoked_filter(app) # As preload does; otherwise the first authenticated route pays for it
+
+    results = []
+    for route, setup, call in build_scenarios(user_ids):
+        arg = setup(client) if setup else None
+        with record_queries(engines) as captured:
+            resp = call(client, arg)
+
+        budget = budgets.get(route, {})
+        allowed = budget.get('allowed_scans', [])
+        scans, failures = [], []
+        for engine, statement, parameters in captured:
+            for table, rows in explain_scans(engine, statement, parameters, table_rows):
+                statement_fingerprint = fingerprint(statement)
+                exempt = _scan_allowed(allowed, table, statement_fingerprint)
+                scans.append({'table': table, 'rows': rows, 'statement': statement_fingerprint, 'allowed': exempt})
+                if rows > row_threshold and not exempt:
+                    failures.append(f"full scan of {table} (~{rows} rows) not in allowed_scans: {statement_fingerprint}")
+
+        if resp.status_code >= 400:
+            failures.append(f"unexpected status {resp.status_code}: {resp.get_data(as_text=True)[:200]}")
+        max_queries = budget.get('max_queries')
+        if max_queries is not None and len(captured) > max_queries:
+            failures.append(f"{len(captured)} queries, budget is {max_queries}")
+
+        results.append({'route': route, 'status': resp.status_code, 'queries': len(captured),
+                        'max_queries': max_queries, 'scans': scans, 'failures': failures})
+    return results
+
+
+def verify_sharding(app):
+    """
+    Cross-shard consistency after the scenarios ran. Returns a list of failure strings:
+    users and requests on the shards their IDs encode, every request mirrored with the
+    same state, and /users/ and /users/suggestions agreeing with a brute-force read.
+    """
+    router = get_router()
+    failures = []
+
+    users = {}
+    for shard in range(router.num_shards):
+        for user in router.session(shard).query(User).all():
+            users[user.id] = user
+            if router.shard_for_user(user.id) != shard or router.shard_for_email(user.email) != shard:
+                failures.append(f"user {user.id} ({user.email}) stored on shard {shard}")
+
+    copies = {}
+    for shard in range(router.num_shards):
+        for friend_request in router.session(shard).query(FriendRequest).all():
+            copies.setdefault(friend_request.id, {})[shard] = (
+                friend_request.requester_id, friend_request.recipient_id, friend_request.status)
+    for request_id, by_shard in copies.items():
+        home = router.shard_for_id(request_id)
+        state = by_shard.get(home)
+        if state is None:
+            failures.append(f"friend request {request_id} missing on its home shard {home}")
+            continue
+        requester_id, recipient_id, _ = state
+        expected = {router.shard_for_user(requester_id), router.shard_for_user(recipient_id)}
+        if home != router.shard_for_user(requester_id):
+            failures.append(f"friend request {request_id} minted on shard {home}, not the requester's")
+        if set(by_shard) != expected:
+            failures.append(f"friend request {request_id} stored on shards {sorted(by_shard)}, expected {sorted(expected)}")
+        if any(copy != state for copy in by_shard.values()):
+            failures.append(f"friend request {request_id} copies disagree: {by_shard}")
+
+    client = app.test_client()
+    actor = min(users)
+    headers = _auth(actor)
+    expected_ids = sorted(uid for uid in users if uid != actor)
+    per_page = 7
+    pages = math.ceil(len(expected_ids) / per_page)
+    for page in (1, 2, pages // 2, pages):
+        body = client.get(f'/users/?page={page}&per_page={per_page}', headers=headers).get_json()
+        got = [user['id'] for user in body['users']]
+        want = expected_ids[(page - 1) * per_page:page * per_page]
+        if got != want or body['total'] != len(expected_ids):
+            failures.append(f"/users/ page {page}: got {got} (total {body['total']}), expected {want} (total {len(expected_ids)})")
+
+    friends = {recipient if requester == actor else requester
+               for requester, recipient, status in (next(iter(c.values())) for c in copies.values())
+               if status == FriendRequestStatus.ACCEPTED and actor in (requester, recipient)}
+    suggested = [user['id'] for user in client.get('/users/suggestions', headers=headers).get_json()]
+    if not suggested or any(uid == actor or uid in friends or uid not in users for uid in suggested):
+        failures.append(f"/users/suggestions returned {suggested} (friends: {sorted(friends)})")
+    return failures
+
+
+def load_budgets(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {'row_threshold': 100, 'routes': {}}
+
+
+def record_budgets(path, budgets, results):
+    """Store the observed query counts as the new budgets, keeping allowed_scans."""
+    routes = budgets.setdefault('routes', {})
+    for result in results:
+        routes.setdefault(result['route'], {})['max_queries'] = result['queries']
+    with open(path, 'w') as f:
+        json.dump(budgets, f, indent=2, sort_keys=True)
+        f.write('\n')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--database-uri', help='Scratch database to seed (default: temporary SQLite file)')
+    parser.add_argument('--budgets', default=DEFAULT_BUDGETS, help='Budgets file (default: %(default)s)')
+    parser.add_argument('--row-threshold', type=int, help='Override row_threshold from the budgets file')
+    parser.add_argument('--record', action='store_true', help='Write observed query counts as the new budgets')
+    parser.add_argument('--shards', type=int, default=1, help='Run sharded over N temporary SQLite files')
+    args = parser.parse_args()
+    sharded = args.shards > 1
+    if sharded and (args.database_uri or args.record):
+        parser.error('--shards uses temporary SQLite files and cannot be combined with --database-uri or --record')
+
+    tmpdir = tempfile.TemporaryDirectory()
+    database_uri = args.database_uri or f"sqlite:///{os.path.join(tmpdir.name, 'query_plans.db')}"
+    shard_uris = [f"sqlite:///{os.path.join(tmpdir.name, f'query_plans_shard{shard}.db')}"
+                  for shard in range(1, args.shards)]
+
+    class CheckConfig(Config):
+        SQLALCHEMY_DATABASE_URI = database_uri
+        SQLALCHEMY_SHARD_URIS = shard_uris
+        JWT_SECRET_KEY = Config.JWT_SECRET_KEY or 'query-plan-check-secret-key-not-for-production'
+        USERS_CACHE_BACKEND = 'none' # Measure the uncached listing path
+        OUTBOX_DISPATCHER_ENABLED = False # Its polling would be counted against routes
+        OUTBOX_ENABLED = True # Budget writes with their outbox inserts
+
+    app = create_app(CheckConfig)
+    budgets = load_budgets(args.budgets)
+    row_threshold = args.row_threshold if args.row_threshold is not None else budgets.get('row_threshold', 100)
+
+    route_budgets = budgets.get('routes', {})
+    if sharded:
+        # Scan exemptions still apply; query counts grow with the shard count
+        route_budgets = {route: {'allowed_scans': budget.get('allowed_scans', [])}
+                         for route, budget in route_budgets.items()}
+
+    with app.app_context():
+        if sharded:
+            result = app.test_cli_runner().invoke(args=['shards', 'create-schema'])
+            if result.exit_code != 0:
+                raise SystemExit(f"shards create-schema failed: {result.output}{result.exception or ''}")
+        else:
+            db.create_all()
+        results = run_checks(app, route_budgets, row_threshold)
+        if sharded:
+            failures = verify_sharding(app)
+            results.append({'route': f'sharding consistency ({args.shards} shards)', 'status': '-', 'queries': 0,
+                            'max_queries': None, 'scans': [], 'failures': failures})
+
+    failed = False
+    for result in results:
+        budget = result['max_queries'] if result['max_queries'] is not None else '-'
+        mark = 'FAIL' if result['failures'] else 'ok'
+        print(f"{mark:4}  {result['route']:36} {result['status']}  queries {result['queries']:>2} / {budget}")
+        for scan in result['scans']:
+            note = 'allowed' if scan['allowed'] else 'scan'
+            print(f"        {note} {scan['table']} (~{scan['rows']} rows): {scan['statement'][:160]}")
+        for failure in result['failures']:
+            print(f"        -> {failure}")
+        failed = failed or bool(result['failures'])
+
+    if args.record:
+        record_budgets(args.budgets, budgets, results)
+        print(f"Recorded query budgets to {args.budgets}")
+        return 0
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,21 @@
+# gunicorn.conf.py
+# Production entry point: gunicorn -c gunicorn.conf.py
+# (gunicorn is not in requirements.txt; install it on the serving host.)
+import multiprocessing
+import os
+
+# Import and warm the app once in the master; workers inherit it via fork
+os.environ.setdefault('APP_PRELOAD', 'True')
+preload_app = True
+wsgi_app = 'run:app'
+
+bind = os.environ.get('GUNICORN_BIND', '127.0.0.1:5000')
+workers = int(os.environ.get('GUNICORN_WORKERS', multiprocessing.cpu_count() * 2 + 1))
+
+
+def post_fork(server, worker):
+    # Inherited pool connections were already disposed (app/utils/warmup.py registers an
+    # at-fork hook); open this worker's own connections before it accepts requests.
+    from run import app
+    from app.utils.warmup import warm_connection_pool
+    warm_connection_pool(app)
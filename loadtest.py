@@ -0,0 +1,393 @@
+# loadtest.py
+"""
+Load-test driver with a realistic mixed workload and a per-endpoint latency report.
+
+The mix: login-heavy bursts, polling of /friend-requests/incoming, sends and accepts,
+and paged /users/ searches. Operations are scheduled open-loop at --rate requests/s
+(so a slow server builds up a backlog instead of silently lowering the load) and
+executed by --workers threads, each with its own keep-alive connection. Latency is
+reported from each op's scheduled time, with the server's service time alongside.
+--start-app runs the app under gunicorn (gunicorn.conf.py); --dev-server falls back to
+the Werkzeug dev server.
+
+    python loadtest.py --start-app --server-workers 4 --users 50 --rate 100 --duration 60
+    python loadtest.py --base-url http://127.0.0.1:5000 --record workload.jsonl
+    python loadtest.py --replay workload.jsonl --speed 2
+
+Only run it against a disposable database: it registers users and sends requests.
+Uses the standard library only (plus gunicorn for --start-app).
+"""
+import argparse
+import http.client
+import importlib.util
+import json
+import os
+import queue
+import random
+import socket
+import subprocess
+import sys
+import threading
+import time
+import uuid
+from urllib.parse import urlencode, urlsplit
+
+# op name -> (weight in the normal mix, endpoint label used in the report, expected statuses).
+# Any other status counts as an error, so a broken token setup (401s) can't pass as 0% errors.
+OPERATIONS = {
+    'login': (5, 'POST /auth/login', (200,)),
+    'poll_incoming': (40, 'GET /friend-requests/incoming', (200,)),
+    'search_users': (25, 'GET /users/?search=', (200,)),
+    'list_friends': (10, 'GET /friend-requests/list', (200,)),
+    # 409: the other user sent us a request first
+    'send_request': (12, 'POST /friend-requests/send/<id>', (201, 409)),
+    'accept_request': (8, 'PUT /friend-requests/<id>/accept', (200,)),
+}
+BURST_WEIGHTS = {'login': 70, 'poll_incoming': 30} # e.g. everyone opening the app at once
+SEARCH_TERMS = ['User', 'a', 'e', 'Load', '1', '2', 'son', 'ie']
+PASSWORD = 'loadtest-password'
+
+
+class Client:
+    """Minimal keep-alive JSON client; one per worker thread."""
+
+    def __init__(self, base_url, timeout=30):
+        parts = urlsplit(base_url)
+        self.host, self.port = parts.hostname, parts.port or 80
+        self.timeout = timeout
+        self.conn = None
+
+    def request(self, method, path, body=None, token=None):
+        headers = {'Content-Type': 'application/json'}
+        if token:
+            headers['Authorization'] = f'Bearer {token}'
+        payload = json.dumps(body) if body is not None else None
+        while True:
+            reused = self.conn is not None
+            if not reused:
+                self.conn = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+            try:
+                try:
+                    self.conn.request(method, path, body=payload, headers=headers)
+                    resp = self.conn.getresponse()
+                except (http.client.RemoteDisconnected, BrokenPipeError, ConnectionResetError):
+                    # A kept-alive connection the server closed before answering: resend once on a
+                    # fresh one. Timeouts and failures after a response started are never retried,
+                    # since the server may have run the request (e.g. a POST).
+                    if not reused:
+                        raise
+                    self.close()
+                    continue
+                data = resp.read()
+            except Exception:
+                self.close()
+                raise
+            if resp.getheader('Connection', '').lower() == 'close':
+                self.close()
+            return resp.status, (json.loads(data) if data else None)
+
+    def close(self):
+        if self.conn is not None:
+            self.conn.close()
+            self.conn = None
+
+
+class VirtualUser:
+    def __init__(self, index, email):
+        self.index = index
+        self.email = email
+        self.user_id = None
+        self.token = None
+        self.sent_to = set()
+        self.lock = threading.Lock()
+        self.accept_lock = threading.Lock() # One accept at a time, so two can't race for a request
+
+
+class Stats:
+    def __init__(self):
+        self.samples = {} # label -> [(latency_seconds, service_seconds, ok, status)]
+        self.lock = threading.Lock()
+
+    def add(self, label, latency, service, ok, status):
+        with self.lock:
+            self.samples.setdefault(label, []).append((latency, service, ok, status))
+
+
+def _percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, int(round(pct / 100 * len(sorted_values))) - 1))
+    return sorted_values[index]
+
+
+def setup_users(base_url, count, run_id):
+    """Register and log in `count` users; returns [VirtualUser]."""
+    client = Client(base_url)
+    users = []
+    for i in range(count):
+        user = VirtualUser(i, f'loadtest-{run_id}-{i}@example.com')
+        client.request('POST', '/auth/register', {'name': f'Load User {i}', 'email': user.email, 'password': PASSWORD})
+        status, body = client.request('POST', '/auth/login', {'email': user.email, 'password': PASSWORD})
+        if status != 200:
+            raise SystemExit(f"Setup failed: could not log in {user.email} ({status}: {body})")
+        user.token = body['access_token']
+        status, body = client.request('GET', '/users/profile', token=user.token)
+        user.user_id = body['id']
+        users.append(user)
+    client.close()
+    return users
+
+
+def generate_workload(num_users, rate, duration, burst_every, burst_seconds, seed=None):
+    """
+    Yield ops as dicts {"t": offset_seconds, "op": name, "user": index, ...params}.
+    For `burst_seconds` out of every `burst_every` seconds the mix switches to BURST_WEIGHTS.
+    """
+    rng = random.Random(seed)
+    normal = list(OPERATIONS), [weight for weight, _, _ in OPERATIONS.values()]
+    burst = list(BURST_WEIGHTS), list(BURST_WEIGHTS.values())
+    for i in range(int(rate * duration)):
+        t = i / rate
+        in_burst = burst_every > 0 and (t % burst_every) < burst_seconds
+        names, weights = burst if in_burst else normal
+        op = {'t': round(t, 4), 'op': rng.choices(names, weights)[0], 'user': rng.randrange(num_users)}
+        if op['op'] == 'search_users':
+            op['search'] = rng.choice(SEARCH_TERMS)
+            op['page'] = rng.choice([1, 1, 1, 2, 3])
+        elif op['op'] == 'send_request':
+            op['target'] = rng.randrange(num_users)
+        yield op
+
+
+def timed(stats, op_name, client, method, path, body=None, token=None, scheduled=None):
+    """
+    One measured request; statuses outside the op's expected set and transport errors count as errors.
+
+    Latency runs from `scheduled` (when the open-loop schedule wanted the request sent), so
+    time spent queued behind busy workers counts against the server instead of being hidden
+    (coordinated omission). Service time runs from the actual send and is recorded alongside.
+    """
+    _, label, expected = OPERATIONS[op_name]
+    started = time.perf_counter()
+    if scheduled is None:
+        scheduled = started
+    try:
+        status, data = client.request(method, path, body, token)
+    except Exception:
+        finished = time.perf_counter()
+        stats.add(label, finished - scheduled, finished - started, False, 'transport')
+        return None, None
+    finished = time.perf_counter()
+    stats.add(label, finished - scheduled, finished - started, status in expected, status)
+    return status, data
+
+
+def execute(client, op, users, stats, scheduled=None):
+    """
+    Run one op, recording a sample per HTTP request it makes. The op's first request is
+    measured from `scheduled`; follow-ups are sent as soon as it returns.
+    """
+    user = users[op['user'] % len(users)]
+    name = op['op']
+
+    if name == 'login':
+        status, body = timed(stats, name, client, 'POST', '/auth/login', {'email': user.email, 'password': PASSWORD},
+                             scheduled=scheduled)
+        if status == 200:
+            user.token = body['access_token']
+    elif name == 'poll_incoming':
+        timed(stats, name, client, 'GET', '/friend-requests/incoming', token=user.token, scheduled=scheduled)
+    elif name == 'list_friends':
+        timed(stats, name, client, 'GET', '/friend-requests/list', token=user.token, scheduled=scheduled)
+    elif name == 'search_users':
+        query = urlencode({'search': op.get('search', ''), 'page': op.get('page', 1), 'per_page': 10})
+        timed(stats, name, client, 'GET', f'/users/?{query}', token=user.token, scheduled=scheduled)
+    elif name == 'send_request':
+        target = users[op.get('target', 0) % len(users)]
+        with user.lock:
+            # Skip pairs we already sent to: a 409 measures nothing interesting
+            if target is user or target.user_id in user.sent_to:
+                target = next((u for u in users if u is not user and u.user_id not in user.sent_to), None)
+            if target is None:
+                return # Everyone already asked; nothing to measure
+            user.sent_to.add(target.user_id)
+        timed(stats, name, client, 'POST', f'/friend-requests/send/{target.user_id}', token=user.token,
+              scheduled=scheduled)
+    elif name == 'accept_request':
+        # Needs a pending request: resolved at run time, so recorded workloads replay cleanly.
+        # The lookup is what a client does first anyway, so it counts as an incoming poll.
+        with user.accept_lock:
+            status, body = timed(stats, 'poll_incoming', client, 'GET', '/friend-requests/incoming',
+                                 token=user.token, scheduled=scheduled)
+            if status == 200 and body:
+                timed(stats, name, client, 'PUT', f"/friend-requests/{body[0]['id']}/accept", token=user.token)
+    else:
+        raise ValueError(f"Unknown op: {name}")
+
+
+def run(base_url, users, ops, workers, speed=1.0):
+    """Dispatch `ops` at their scheduled offsets across `workers` threads."""
+    stats = Stats()
+    work = queue.Queue(maxsize=workers * 4)
+    late = [0]
+
+    def worker():
+        client = Client(base_url)
+        while True:
+            item = work.get()
+            if item is None:
+                break
+            op, due = item
+            execute(client, op, users, stats, scheduled=due)
+        client.close()
+
+    threads = [threading.Thread(target=worker, daemon=True) for _ in range(workers)]
+    for thread in threads:
+        thread.start()
+
+    began = time.perf_counter()
+    for op in ops:
+        due = began + op['t'] / speed
+        delay = due - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        elif delay < -0.1:
+            late[0] += 1 # Workers can't keep up with the target rate
+        work.put((op, due))
+    for _ in threads:
+        work.put(None)
+    for thread in threads:
+        thread.join()
+    return stats, time.perf_counter() - began, late[0]
+
+
+def report(stats, elapsed, late):
+    rows = []
+    for label in sorted(stats.samples):
+        samples = stats.samples[label]
+        latencies = sorted(latency for latency, _, _, _ in samples)
+        service = sorted(service for _, service, _, _ in samples)
+        errors = sum(1 for _, _, ok, _ in samples if not ok)
+        statuses = {}
+        for _, _, _, status in samples:
+            statuses[str(status)] = statuses.get(str(status), 0) + 1
+        rows.append({
+            'endpoint': label,
+            'requests': len(samples),
+            'throughput_rps': len(samples) / elapsed if elapsed else 0.0,
+            'p50_ms': _percentile(latencies, 50) * 1000,
+            'p95_ms': _percentile(latencies, 95) * 1000,
+            'p99_ms': _percentile(latencies, 99) * 1000,
+            'max_ms': latencies[-1] * 1000 if latencies else 0.0,
+            'service_p50_ms': _percentile(service, 50) * 1000,
+            'service_p99_ms': _percentile(service, 99) * 1000,
+            'error_rate': errors / len(samples) if samples else 0.0,
+            'statuses': statuses,
+        })
+
+    # p50..max: from the scheduled send time (what a user would see); svc: from the actual send
+    print(f"\n{'endpoint':36} {'reqs':>6} {'rps':>7} {'p50':>8} {'p95':>8} {'p99':>8} {'max':>8} "
+          f"{'svc p50':>9} {'svc p99':>9} {'errors':>7}")
+    for row in rows:
+        print(f"{row['endpoint']:36} {row['requests']:>6} {row['throughput_rps']:>7.1f} "
+              f"{row['p50_ms']:>7.1f}ms {row['p95_ms']:>7.1f}ms {row['p99_ms']:>7.1f}ms "
+              f"{row['max_ms']:>7.1f}ms {row['service_p50_ms']:>7.1f}ms {row['service_p99_ms']:>7.1f}ms "
+              f"{row['error_rate']:>6.1%}")
+    for row in rows:
+        if row['error_rate']:
+            print(f"  {row['endpoint']}: responses by status {row['statuses']}")
+    total = sum(row['requests'] for row in rows)
+    print(f"\n{total} requests in {elapsed:.1f}s ({total / elapsed if elapsed else 0:.1f} req/s); "
+          f"{late} ops started more than 100ms late")
+    return rows
+
+
+def start_app(port, server_workers=None, dev_server=False):
+    """
+    Start the app in a subprocess and wait for it: under gunicorn with gunicorn.conf.py (the
+    production setup, preload included), or the threaded Werkzeug dev server if `dev_server`.
+    """
+    root = os.path.dirname(os.path.abspath(__file__))
+    if dev_server:
+        code = f"from run import app; app.run(host='127.0.0.1', port={port}, threaded=True, debug=False)"
+        command = [sys.executable, '-c', code]
+    else:
+        if importlib.util.find_spec('gunicorn') is None:
+            raise SystemExit("--start-app needs gunicorn (pip install gunicorn); pass --dev-server to use "
+                             "the Werkzeug dev server instead.")
+        command = [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', '--bind', f'127.0.0.1:{port}']
+        if server_workers:
+            command += ['--workers', str(server_workers)]
+    proc = subprocess.Popen(command, cwd=root)
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=0.5).close()
+            return proc
+        except OSError:
+            if proc.poll() is not None:
+                raise SystemExit("App process exited during startup.")
+            time.sleep(0.2)
+    proc.terminate()
+    raise SystemExit("App did not start listening within 30s.")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--base-url', default='http://127.0.0.1:5000')
+    parser.add_argument('--start-app', action='store_true', help='Start run.py:app locally on --port first')
+    parser.add_argument('--port', type=int, default=5055, help='Port for --start-app (default: %(default)s)')
+    parser.add_argument('--server-workers', type=int,
+                        help='gunicorn workers for --start-app (default: GUNICORN_WORKERS or 2 x CPUs + 1)')
+    parser.add_argument('--dev-server', action='store_true',
+                        help='With --start-app, use the Werkzeug dev server instead of gunicorn')
+    parser.add_argument('--users', type=int, default=50, help='Virtual users to register (default: %(default)s)')
+    parser.add_argument('--workers', type=int, default=16, help='Concurrent workers (default: %(default)s)')
+    parser.add_argument('--rate', type=float, default=50, help='Target requests/s (default: %(default)s)')
+    parser.add_argument('--duration', type=float, default=30, help='Seconds to sustain the rate (default: %(default)s)')
+    parser.add_argument('--burst-every', type=float, default=15, help='Seconds between login bursts, 0 to disable')
+    parser.add_argument('--burst-seconds', type=float, default=3, help='Length of each login burst')
+    parser.add_argument('--seed', type=int, help='Random seed for a reproducible mix')
+    parser.add_argument('--record', metavar='FILE', help='Write the generated workload to a JSONL file')
+    parser.add_argument('--replay', metavar='FILE', help='Replay a recorded JSONL workload instead of generating one')
+    parser.add_argument('--speed', type=float, default=1.0, help='Replay speed multiplier (default: %(default)s)')
+    parser.add_argument('--json-report', metavar='FILE', help='Also write the report as JSON')
+    args = parser.parse_args()
+
+    proc = None
+    base_url = args.base_url
+    if args.start_app:
+        proc = start_app(args.port, args.server_workers, args.dev_server)
+        base_url = f'http://127.0.0.1:{args.port}'
+
+    try:
+        if args.replay:
+            with open(args.replay) as f:
+                ops = [json.loads(line) for line in f if line.strip()]
+            num_users = max((op['user'] for op in ops), default=0) + 1
+        else:
+            num_users = args.users
+            ops = list(generate_workload(num_users, args.rate, args.duration,
+                                         args.burst_every, args.burst_seconds, args.seed))
+        if args.record:
+            with open(args.record, 'w') as f:
+                for op in ops:
+                    f.write(json.dumps(op) + '\n')
+
+        print(f"Registering {num_users} users against {base_url} ...")
+        users = setup_users(base_url, num_users, uuid.uuid4().hex[:8])
+        print(f"Running {len(ops)} ops with {args.workers} workers ...")
+        stats, elapsed, late = run(base_url, users, ops, args.workers, args.speed)
+        rows = report(stats, elapsed, late)
+        if args.json_report:
+            with open(args.json_report, 'w') as f:
+                json.dump({'elapsed_seconds': elapsed, 'late_ops': late, 'endpoints': rows}, f, indent=2)
+    finally:
+        if proc is not None:
+            proc.terminate()
+            proc.wait()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())